@@ -0,0 +1,120 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from fastapi import HTTPException, Request, status
+import metrics
+
+# Limits are per API process. With several workers keep
+# workers * sum(concurrency) + listeners below Postgres max_connections (50).
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+
+def _setting(route_class: str, name: str, default: float) -> float:
+    return float(os.getenv(f"ADMISSION_{route_class.upper()}_{name}", default))
+
+class RouteClass:
+    """Concurrency limit, bounded wait queue and per-client token buckets for one kind of route.
+
+    A request waits for a free slot at most `max_wait` seconds. It is shed up
+    front when the queue is full or when the expected wait, estimated from the
+    recent service time, already exceeds `max_wait`.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue: int, max_wait: float, rate: float, burst: float):
+        self.name = name
+        self.concurrency = int(_setting(name, "CONCURRENCY", concurrency))
+        self.queue = int(_setting(name, "QUEUE", queue))
+        self.max_wait = _setting(name, "MAX_WAIT", max_wait)
+        self.rate = _setting(name, "RATE", rate)
+        self.burst = _setting(name, "BURST", burst)
+        self.active = 0
+        self.avg_service_time = 0.0
+        self._waiters = deque()
+        self._buckets = OrderedDict()
+        metrics.gauge(f"admission.{name}.in_flight", lambda: self.active)
+        metrics.gauge(f"admission.{name}.waiting", lambda: len(self._waiters))
+
+    def _reject(self, reason: str, retry_after: float, code=status.HTTP_503_SERVICE_UNAVAILABLE):
+        metrics.incr(f"admission.{self.name}.{reason}")
+        detail = "Too many requests" if code == status.HTTP_429_TOO_MANY_REQUESTS else "Server busy, retry later"
+        raise HTTPException(status_code=code, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    def check_rate(self, client: str):
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[client] = (tokens, now)
+            self._reject("rate_limited", (1 - tokens) / self.rate, status.HTTP_429_TOO_MANY_REQUESTS)
+        self._buckets[client] = (tokens - 1, now)
+        if len(self._buckets) > RATE_LIMIT_MAX_CLIENTS:
+            self._buckets.popitem(last=False)
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            metrics.incr(f"admission.{self.name}.admitted")
+            return
+        if len(self._waiters) >= self.queue:
+            self._reject("rejected_queue_full", self.max_wait)
+        expected_wait = (len(self._waiters) + 1) * self.avg_service_time / self.concurrency
+        if expected_wait > self.max_wait:
+            self._reject("rejected_deadline", expected_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.incr(f"admission.{self.name}.queued")
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up, pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("rejected_deadline", self.max_wait)
+            raise
+        metrics.incr(f"admission.{self.name}.admitted")
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter so newcomers cannot overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def record_service_time(self, seconds: float):
+        self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * seconds
+
+def client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR and "x-forwarded-for" in request.headers:
+        return request.headers["x-forwarded-for"].split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def limit(route_class: RouteClass, client_key=client_ip):
+    """Build a dependency that admits a request into `route_class` or fails fast with 429/503."""
+    async def admit(request: Request):
+        route_class.check_rate(client_key(request))
+        await route_class.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            route_class.record_service_time(time.monotonic() - started)
+            route_class.release()
+    return admit
+
+READ = RouteClass("read", concurrency=16, queue=64, max_wait=2, rate=20, burst=40)
+AGGREGATE = RouteClass("aggregate", concurrency=6, queue=24, max_wait=5, rate=5, burst=10)
+WRITE = RouteClass("write", concurrency=8, queue=32, max_wait=5, rate=5, burst=10)
+LOGIN = RouteClass("login", concurrency=4, queue=16, max_wait=3, rate=0.5, burst=5)
+
+def total_concurrency() -> int:
+    """Requests admitted at once across all route classes."""
+    return sum(route_class.concurrency for route_class in (READ, AGGREGATE, WRITE, LOGIN))
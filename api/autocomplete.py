@@ -0,0 +1,180 @@
+import bisect
+import heapq
+import os
+import threading
+import time
+import unicodedata
+import crud
+
+MAX_SUGGESTIONS = 20
+# Prefixes matching more keys than this keep their ranked top list memoized
+BROAD_PREFIX_SIZE = int(os.getenv("AUTOCOMPLETE_BROAD_PREFIX_SIZE", "2000"))
+# Popularity changes with every review, the whole index is rebuilt this often
+RELOAD_SECONDS = float(os.getenv("AUTOCOMPLETE_RELOAD_SECONDS", "900"))
+# Title edits heard from the listener are collected this long and applied in one query
+REFRESH_DEBOUNCE_SECONDS = float(os.getenv("AUTOCOMPLETE_REFRESH_DEBOUNCE_SECONDS", "0.5"))
+MAX_KEY_LENGTH = 64
+
+def normalize(text: str) -> str:
+    """Fold case the Unicode way so 'МАТРИЦА' matches 'матрица', and treat 'ё' as 'е'."""
+    return unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+
+def _word_keys(title: str):
+    # One key per word start, so 'колец' finds 'Властелин колец'
+    folded = normalize(title)
+    return {folded[i:i + MAX_KEY_LENGTH] for i, char in enumerate(folded)
+            if char.isalnum() and (i == 0 or not folded[i - 1].isalnum())}
+
+class TitleIndex:
+    """Sorted array of (title key, film id) pairs for prefix lookups ranked by popularity."""
+
+    def __init__(self):
+        self.loaded_at = None
+        self._entries = []
+        self._films = {}
+        self._top = {}
+        self._lock = threading.Lock()
+
+    def build(self, rows):
+        films = {row['id']: self._film(row) for row in rows}
+        entries = sorted((key, film_id) for film_id, film in films.items() for key in _word_keys(film['filmname']))
+        with self._lock:
+            self._films, self._entries, self._top = films, entries, {}
+            self.loaded_at = time.monotonic()
+
+    def upsert(self, row):
+        with self._lock:
+            self._remove(row['id'])
+            film = self._films[row['id']] = self._film(row)
+            keys = _word_keys(film['filmname'])
+            for key in keys:
+                bisect.insort(self._entries, (key, row['id']))
+            # Memoized lists are patched in place, rebuilding one costs a scan of the whole prefix range
+            for prefix, top in self._top.items():
+                if any(key.startswith(prefix) for key in keys):
+                    top.append(film['id'])
+                    top.sort(key=lambda film_id: self._films[film_id]['score'], reverse=True)
+                    del top[MAX_SUGGESTIONS:]
+
+    def remove(self, film_id: int):
+        with self._lock:
+            self._remove(film_id)
+
+    def search(self, query: str, limit: int = 10):
+        prefix = normalize(query).strip()[:MAX_KEY_LENGTH]
+        if not prefix:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._entries, (prefix,))
+            end = bisect.bisect_left(self._entries, (prefix + "\U0010ffff",))
+            top = self._top.get(prefix)
+            if top is None:
+                film_ids = {film_id for _, film_id in self._entries[start:end]}
+                top = heapq.nlargest(MAX_SUGGESTIONS, film_ids, key=lambda film_id: self._films[film_id]['score'])
+                if end - start > BROAD_PREFIX_SIZE:
+                    self._top[prefix] = top
+            return [self._films[film_id] for film_id in top[:limit]]
+
+    def __len__(self):
+        return len(self._films)
+
+    def _remove(self, film_id: int):
+        film = self._films.pop(film_id, None)
+        if film is None:
+            return
+        for prefix, top in list(self._top.items()):
+            if film_id in top:
+                if len(top) == MAX_SUGGESTIONS:
+                    # The runner-up is unknown, recompute on next use
+                    del self._top[prefix]
+                else:
+                    top.remove(film_id)
+        for key in _word_keys(film['filmname']):
+            position = bisect.bisect_left(self._entries, (key, film_id))
+            if position < len(self._entries) and self._entries[position] == (key, film_id):
+                del self._entries[position]
+
+    @staticmethod
+    def _film(row):
+        return {
+            'id': row['id'],
+            'filmname': row['filmname'],
+            'year': row['year'],
+            'score': (row['review_count'], float(row['average_rating']), -row['id'])
+        }
+
+index = TitleIndex()
+_load_lock = threading.Lock()
+
+def load(conn):
+    index.build(crud.get_title_popularity(conn))
+    print(f"Autocomplete index loaded with {len(index)} films")
+
+def refresh_films(conn, film_ids):
+    rows = {row['id']: row for row in crud.get_title_popularity(conn, film_ids=film_ids)}
+    for film_id in film_ids:
+        if film_id in rows:
+            index.upsert(rows[film_id])
+        else:
+            index.remove(film_id)
+
+_pending = set()
+_pending_lock = threading.Lock()
+_pending_added = threading.Event()
+_refresher = None
+
+def refresh_later(film_id: int, connection):
+    """Queue a film for refresh off the caller's thread, `connection` is a context manager factory.
+
+    The listener thread calls this, so it never waits for the database and a
+    burst of edits costs one query.
+    """
+    global _refresher
+    with _pending_lock:
+        _pending.add(film_id)
+        if _refresher is None:
+            _refresher = threading.Thread(target=_refresh_forever, args=(connection,), name="autocomplete-refresher", daemon=True)
+            _refresher.start()
+    _pending_added.set()
+
+def _refresh_forever(connection):
+    while True:
+        _pending_added.wait()
+        time.sleep(REFRESH_DEBOUNCE_SECONDS)
+        _pending_added.clear()
+        with _pending_lock:
+            film_ids = sorted(_pending)
+            _pending.clear()
+        try:
+            with connection() as conn:
+                refresh_films(conn, film_ids)
+        except Exception as e:
+            print(f"Autocomplete refresh failed, the next rebuild catches up: {e}")
+
+def _load_with(connection):
+    with connection() as conn:
+        load(conn)
+
+def _reload_in_background(connection):
+    try:
+        _load_with(connection)
+    except Exception as e:
+        print(f"Autocomplete reload failed: {e}")
+    finally:
+        _load_lock.release()
+
+def reload(connection):
+    with _load_lock:
+        _load_with(connection)
+
+def ensure_loaded(connection):
+    """Load the index on first use and rebuild it in the background once it is older than RELOAD_SECONDS.
+
+    `connection` is a context manager factory such as database.primary.
+    """
+    if index.loaded_at is None:
+        with _load_lock:
+            if index.loaded_at is None:
+                _load_with(connection)
+    elif time.monotonic() - index.loaded_at > RELOAD_SECONDS and _load_lock.acquire(blocking=False):
+        threading.Thread(target=_reload_in_background, args=(connection,), daemon=True).start()
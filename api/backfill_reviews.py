@@ -0,0 +1,85 @@
+"""Online backfill of REVIEW into the hash-partitioned REVIEW_PARTITIONED (see V0005).
+
+Rows are copied in id order in small committed batches, so the source table
+is only briefly share-locked batch by batch. Writes made meanwhile are
+mirrored by a trigger, and re-running the tool is safe. Once it has caught
+up, --finish swaps the tables.
+
+    python backfill_reviews.py --batch-size 5000 --pause 0.1
+    python backfill_reviews.py --finish
+"""
+import argparse
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from database import DATABASE_URL
+
+def copy_batch(conn, after_id: int, batch_size: int):
+    with conn.cursor() as cur:
+        # FOR SHARE makes concurrent updates and deletes of the batch wait for us,
+        # so a row deleted after our snapshot cannot be copied back to life.
+        cur.execute("""
+            WITH batch AS (
+                SELECT ID, ReviewText, TenGrade, BinaryGrade, FilmID, UserID
+                FROM REVIEW
+                WHERE ID > %s
+                ORDER BY ID
+                LIMIT %s
+                FOR SHARE
+            ),
+            copied AS (
+                INSERT INTO REVIEW_PARTITIONED (ID, ReviewText, TenGrade, BinaryGrade, FilmID, UserID)
+                SELECT ID, ReviewText, TenGrade, BinaryGrade, FilmID, UserID FROM batch
+                ON CONFLICT (FilmID, ID) DO NOTHING
+                RETURNING 1
+            )
+            SELECT (SELECT MAX(ID) FROM batch) AS last_id,
+                   (SELECT COUNT(*) FROM batch) AS seen,
+                   (SELECT COUNT(*) FROM copied) AS copied
+        """, (after_id, batch_size))
+        result = cur.fetchone()
+    conn.commit()
+    return result
+
+def backfill(conn, batch_size: int, pause: float, start_id: int):
+    last_id = start_id
+    total = 0
+    while True:
+        result = copy_batch(conn, last_id, batch_size)
+        if result['last_id'] is None:
+            break
+        last_id = result['last_id']
+        total += result['copied']
+        print(f"Copied {result['copied']}/{result['seen']} rows up to id {last_id} ({total} total)")
+        time.sleep(pause)
+    print(f"Backfill done, {total} rows copied")
+
+def finish(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT (SELECT COUNT(*) FROM REVIEW) AS source, (SELECT COUNT(*) FROM REVIEW_PARTITIONED) AS target")
+        counts = cur.fetchone()
+        if counts['source'] != counts['target']:
+            raise SystemExit(f"Row counts differ ({counts['source']} vs {counts['target']}), run the backfill again first")
+        cur.execute("CALL finish_review_partitioning()")
+    conn.commit()
+    print("REVIEW is now partitioned, the old table is kept as REVIEW_UNPARTITIONED")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds to sleep between batches")
+    parser.add_argument("--start-id", type=int, default=0, help="resume after this review id")
+    parser.add_argument("--finish", action="store_true", help="swap the tables after verifying row counts")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    try:
+        if args.finish:
+            finish(conn)
+        else:
+            backfill(conn, args.batch_size, args.pause, args.start_id)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
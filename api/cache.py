@@ -0,0 +1,62 @@
+import threading
+import time
+
+class LocalCache:
+    """Small thread-safe in-process cache with a TTL.
+
+    Entries are also dropped by the change listener when the rows they were
+    built from change in another worker, the TTL only bounds staleness if
+    notifications are lost. Callers that compute a value from the database
+    should read ``generation`` before the query and pass it to ``set``, so a
+    result that raced with an invalidation is not stored.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            with self._lock:
+                self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, generation=None, ttl=None):
+        """Store value for the cache's TTL, or for `ttl` seconds when that is shorter."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if len(self._data) >= self.max_entries and key not in self._data:
+                # Evict the entry closest to expiry instead of growing without bound
+                oldest = min(self._data, key=lambda k: self._data[k][1])
+                del self._data[oldest]
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self.generation += 1
+
+    def discard(self, predicate):
+        """Drop every entry whose value matches predicate."""
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(value)]:
+                del self._data[key]
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def __len__(self):
+        return len(self._data)
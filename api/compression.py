@@ -0,0 +1,232 @@
+import gzip
+import os
+import re
+import threading
+import time
+import anyio
+from cache import LocalCache
+import metrics
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# A miss within this many seconds of an invalidation of its page is filled from the primary
+RESPONSE_CACHE_PRIMARY_SECONDS = float(os.getenv("RESPONSE_CACHE_PRIMARY_SECONDS", "5"))
+
+# Anonymous GETs of these paths are cached together with their compressed variants, under
+# tags naming what the page shows, so a change only drops the pages it appears on. /films/
+# is tagged "snapshot" instead of "films" when it was served from the film_card snapshot.
+CACHEABLE_PATHS = [
+    (re.compile(r"^/films/$"), lambda match: ("films", "snapshot")),
+    (re.compile(r"^/films/(\d+)/reviews$"), lambda match: (f"film:{match.group(1)}", "film_reviews")),
+    (re.compile(r"^/reviews/$"), lambda match: ("reviews",)),
+]
+# This worker's own writes, and the tags they drop; an empty tuple drops everything
+WRITE_PATHS = [
+    (re.compile(r"^/films/(\d+)/reviews$"), lambda match: ("films", "reviews", f"film:{match.group(1)}")),
+    (re.compile(r"^/(films|genres|reviews)/"), lambda match: ()),
+]
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+# Headers holding an age in seconds, advanced by the time a page spent in the cache
+AGE_HEADERS = (b"x-snapshot-age",)
+STREAMING_TYPES = (b"text/event-stream",)
+
+def _encode(body: bytes, encoding: str, cached: bool) -> bytes:
+    # Cached bodies are compressed once and served many times, so they get a higher level
+    if encoding == "br":
+        return brotli.compress(body, quality=9 if cached else 4)
+    return gzip.compress(body, compresslevel=9 if cached else 5)
+
+def choose_encoding(accept_encoding: str):
+    """The supported encoding with the client's highest q-value, ties go to br."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0  # a malformed q-value doesn't accept the encoding
+        accepted[name.strip().lower()] = quality
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+    qualities = [(accepted.get(encoding, accepted.get("*", 0)), encoding) for encoding in supported]
+    # max() keeps the first of equal q-values, so the server's order breaks ties
+    quality, encoding = max(qualities, key=lambda item: item[0])
+    return encoding if quality > 0 else None
+
+response_cache = LocalCache(ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES)
+metrics.gauge("response_cache.entries", lambda: len(response_cache))
+
+_invalidation_lock = threading.Lock()
+_invalidations = 0
+# tag, or "*" for everything -> (invalidation number, monotonic time) of its last invalidation
+_invalidated = {}
+
+def _tags_for(path: str, patterns):
+    for pattern, tags in patterns:
+        match = pattern.match(path)
+        if match:
+            return tags(match)
+    return None
+
+def invalidate(*tags):
+    """Drop the cached pages carrying any of tags, or every page when no tag is given."""
+    global _invalidations
+    with _invalidation_lock:
+        _invalidations += 1
+        stamp = (_invalidations, time.monotonic())
+        for tag in tags or ("*",):
+            _invalidated[tag] = stamp
+        if len(_invalidated) > RESPONSE_CACHE_MAX_ENTRIES:
+            # Invalidations older than any cached page or running fill no longer matter
+            horizon = stamp[1] - max(RESPONSE_CACHE_TTL, RESPONSE_CACHE_PRIMARY_SECONDS)
+            for tag in [tag for tag, (_, at) in _invalidated.items() if at < horizon]:
+                del _invalidated[tag]
+        if tags:
+            dropped = set(tags)
+            response_cache.discard(lambda cached: not dropped.isdisjoint(cached.tags))
+        else:
+            response_cache.clear()
+
+def _recently_invalidated(tags) -> bool:
+    horizon = time.monotonic() - RESPONSE_CACHE_PRIMARY_SECONDS
+    return any(_invalidated.get(tag, (0, horizon))[1] > horizon for tag in tags + ("*",))
+
+def _store(key, cached, since: int, ttl=None):
+    # A page whose query raced with an invalidation of one of its tags may predate the change
+    with _invalidation_lock:
+        if any(_invalidated.get(tag, (0, 0))[0] > since for tag in cached.tags + ("*",)):
+            metrics.incr("response_cache.stale_fills")
+            return
+        response_cache.set(key, cached, ttl=ttl)
+
+class CachedResponse:
+    def __init__(self, status: int, headers: list, body: bytes, tags: tuple = ()):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.tags = tags
+        self.encoded = {}
+        self.cached_at = time.monotonic()
+
+    def current_headers(self):
+        if not any(name.lower() in AGE_HEADERS for name, _ in self.headers):
+            return list(self.headers)
+        elapsed = time.monotonic() - self.cached_at
+        return [(name, f"{float(value) + elapsed:.1f}".encode() if name.lower() in AGE_HEADERS else value)
+                for name, value in self.headers]
+
+class CompressionMiddleware:
+    """Negotiate gzip/brotli for large JSON bodies and cache anonymous listing pages.
+
+    Cached pages keep the compressed bytes next to the plain body, so a hot
+    page is compressed once per encoding instead of on every hit. The cache
+    is only used while `cache_enabled()` is true. Pages are dropped by tag
+    through `invalidate()`, and by successful writes going through this
+    process. A miss shortly after its page was invalidated sets
+    `request.state.read_primary`, so get_read_db fills the cache from the
+    primary: a lagging replica would otherwise pin a pre-write page until its
+    TTL runs out. A route may shorten the TTL of its page with
+    `request.state.cache_ttl`. HEAD requests are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE, cache_enabled=lambda: True):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache_enabled = cache_enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        cache_key = None
+        tags = None
+        if scope["method"] == "GET" and b"authorization" not in headers and self.cache_enabled():
+            tags = _tags_for(scope["path"], CACHEABLE_PATHS)
+        if tags is not None:
+            cache_key = scope["path"] + "?" + scope["query_string"].decode("latin-1")
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                metrics.incr("response_cache.hits")
+                await self._send_cached(cached, encoding, send)
+                return
+            metrics.incr("response_cache.misses")
+            if _recently_invalidated(tags):
+                metrics.incr("response_cache.primary_fills")
+                scope.setdefault("state", {})["read_primary"] = True
+
+        since = _invalidations
+        start = None
+        chunks = []
+        streaming = False
+
+        async def buffer_send(message):
+            nonlocal start, streaming
+            if streaming:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                start = message
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                if content_type.startswith(STREAMING_TYPES):
+                    # Event streams must reach the client as they are produced
+                    streaming = True
+                    await send(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await self._finish(scope, start, b"".join(chunks), encoding, cache_key, tags, since, send)
+            else:
+                await send(message)
+
+        await self.app(scope, receive, buffer_send)
+
+    async def _finish(self, scope, start, body, encoding, cache_key, tags, since, send):
+        status = start["status"]
+        headers = [(name, value) for name, value in start.get("headers", []) if name.lower() != b"content-length"]
+        if scope["method"] != "GET" and status < 400:
+            # This worker's own write, don't wait for the notification to come back
+            written = _tags_for(scope["path"], WRITE_PATHS)
+            if written is not None:
+                invalidate(*written)
+
+        if cache_key is not None and status == 200:
+            snapshot = any(name.lower() == b"x-snapshot-age" for name, _ in headers)
+            tags = tuple(tag for tag in tags if tag != ("films" if snapshot else "snapshot"))
+            cached = CachedResponse(status, headers, body, tags)
+            _store(cache_key, cached, since, ttl=scope.get("state", {}).get("cache_ttl"))
+            await self._send_cached(cached, encoding, send)
+            return
+
+        content_type = dict(headers).get(b"content-type", b"")
+        if (encoding and len(body) >= self.minimum_size and content_type.startswith(COMPRESSIBLE_TYPES)
+                and b"content-encoding" not in dict(headers)):
+            body = await anyio.to_thread.run_sync(_encode, body, encoding, False)
+            headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding")]
+        await self._send(status, headers, body, send)
+
+    async def _send_cached(self, cached: CachedResponse, encoding, send):
+        headers = cached.current_headers() + [(b"vary", b"Accept-Encoding")]
+        body = cached.body
+        if encoding and len(body) >= self.minimum_size:
+            if encoding not in cached.encoded:
+                metrics.incr(f"response_cache.compressed.{encoding}")
+                cached.encoded[encoding] = await anyio.to_thread.run_sync(_encode, body, encoding, True)
+            body = cached.encoded[encoding]
+            headers.append((b"content-encoding", encoding.encode()))
+        await self._send(cached.status, headers, body, send)
+
+    @staticmethod
+    async def _send(status, headers, body, send):
+        headers = headers + [(b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
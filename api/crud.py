@@ -1,9 +1,85 @@
 from passlib.context import CryptContext
 from psycopg2.extras import RealDictCursor
 from datetime import date
+from singleflight import coalesce
+from repository import dispatch
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Per-film aggregates for queries over film f. Review is hash-partitioned by filmid,
+# so every review access has to filter on filmid to hit a single partition.
+FILM_GENRES = """COALESCE((SELECT array_agg(g.genrename ORDER BY g.genrename)
+                           FROM film_genre fg JOIN genre g ON fg.genreid = g.id
+                           WHERE fg.filmid = f.id), ARRAY[]::text[])"""
+FILM_RATING = "COALESCE((SELECT AVG(r.tengrade) FROM review r WHERE r.filmid = f.id), 0)"
+
+# Selectable fields of each object for ?fields=, mapped to their SQL. Aggregates are only
+# computed, and joins only made, when one of their fields is requested.
+FILM_FIELDS = {
+    'id': "f.id",
+    'filmname': "f.filmname",
+    'description': "f.description",
+    'year': "f.year",
+    'genres': FILM_GENRES,
+    'average_rating': FILM_RATING
+}
+REVIEW_FIELDS = {
+    'id': "r.id",
+    'reviewtext': "r.reviewtext",
+    'tengrade': "r.tengrade",
+    'binarygrade': "r.binarygrade"
+}
+USER_IN_REVIEW_FIELDS = {
+    'id': "u.id",
+    'name': "u.name",
+    'email': "u.email",
+    'role': "u.role"
+}
+# The same fields read from the film_card materialized view, see V0008
+FILM_CARD_FIELDS = {name: f"fc.{name}" for name in FILM_FIELDS}
+FILM_CARD_LOCK = 0x66696c6d  # advisory lock held while refreshing film_card
+
+# Review fields can also name the embedded objects, whole ('film') or a single field ('film.filmname')
+REVIEW_FIELD_NAMES = (set(REVIEW_FIELDS) | {'film', 'user'}
+                      | {f"film.{name}" for name in FILM_FIELDS} | {f"user.{name}" for name in USER_IN_REVIEW_FIELDS})
+
+def _pick(columns: dict, fields=None):
+    """Columns to select for the requested field names, all of them when fields is None. The id is always kept."""
+    if fields is None:
+        return dict(columns)
+    return {name: sql for name, sql in columns.items() if name == 'id' or name in fields}
+
+def _select_list(columns: dict, prefix: str = ""):
+    return ",\n                   ".join(f"{sql} AS {prefix}{name}" for name, sql in columns.items())
+
+def _review_selection(fields=None):
+    """Split review fields into the review, film and user columns to select, None for an object that is not requested."""
+    if fields is None:
+        return dict(REVIEW_FIELDS), dict(FILM_FIELDS), dict(USER_IN_REVIEW_FIELDS)
+
+    def nested(name, columns):
+        if name in fields:
+            return dict(columns)
+        picked = {field.split(".", 1)[1] for field in fields if field.startswith(name + ".")}
+        return _pick(columns, picked) if picked else None
+
+    return _pick(REVIEW_FIELDS, fields), nested('film', FILM_FIELDS), nested('user', USER_IN_REVIEW_FIELDS)
+
+def _round_rating(film):
+    if 'average_rating' in film:
+        film['average_rating'] = round(film['average_rating'], 2)
+    return film
+
+def _nest_review(row, film_columns, user_columns):
+    """Rebuild a flat review row with film_/user_ prefixed columns into the ReviewWithFilmAndUser shape."""
+    review = {name: value for name, value in row.items() if not name.startswith(("film_", "user_"))}
+    if film_columns is not None:
+        review['film'] = _round_rating({name: row[f"film_{name}"] for name in film_columns})
+    if user_columns is not None:
+        review['user'] = {name: row[f"user_{name}"] for name in user_columns}
+    return review
+
+@dispatch
 def get_user_by_email(conn, email: str):
     with conn.cursor() as cur:
         cur.execute("SELECT * FROM filmuser WHERE email = %s", (email,))
@@ -14,7 +90,7 @@ def get_user_by_email(conn, email: str):
             print(f"No user found for email: {email}")
         return user
 
-def create_user(conn, user):
+def check_registration_age(user):
     # Calculate age
     today = date.today()
     birth_date = user.dateofbirth
@@ -23,6 +99,9 @@ def create_user(conn, user):
     if age < 13:
         raise ValueError("User must be at least 13 years old to register")
 
+@dispatch
+def create_user(conn, user):
+    check_registration_age(user)
     hashed_password = pwd_context.hash(user.password)
     with conn.cursor() as cur:
         cur.execute("""
@@ -33,11 +112,13 @@ def create_user(conn, user):
         conn.commit()
         return cur.fetchone()
 
+@dispatch
 def get_users(conn, skip: int = 0, limit: int = 100):
     with conn.cursor() as cur:
-        cur.execute("SELECT id, email, name, gender, dateofbirth FROM filmuser OFFSET %s LIMIT %s", (skip, limit))
+        cur.execute("SELECT id, email, name, gender, dateofbirth, role FROM filmuser OFFSET %s LIMIT %s", (skip, limit))
         return cur.fetchall()
 
+@dispatch
 def create_film(conn, film):
     with conn.cursor() as cur:
         genre_names = film.genres if film.genres else []
@@ -65,22 +146,19 @@ def create_film(conn, film):
         
         return {**new_film, 'genres': genres}
 
-def get_films(conn, skip: int = 0, limit: int = 100):
+@coalesce
+@dispatch
+def get_films(conn, skip: int = 0, limit: int = 100, fields: tuple = None):
     with conn.cursor() as cur:
         # Get total count
         cur.execute("SELECT COUNT(*) FROM film")
         total_count = cur.fetchone()['count']
 
-        # Get films with pagination
-        cur.execute("""
-            SELECT f.id, f.filmname, f.description, f.year, 
-                   COALESCE(array_agg(g.genrename) FILTER (WHERE g.genrename IS NOT NULL), ARRAY[]::text[]) as genres,
-                   COALESCE(AVG(r.tengrade), 0) as average_rating
+        # Get films with pagination. Genres and ratings are correlated subqueries so they
+        # are only computed for the page and each review probe is pruned to one partition.
+        cur.execute(f"""
+            SELECT {_select_list(_pick(FILM_FIELDS, fields))}
             FROM film f
-            LEFT JOIN film_genre fg ON f.id = fg.filmid
-            LEFT JOIN genre g ON fg.genreid = g.id
-            LEFT JOIN review r ON f.id = r.filmid
-            GROUP BY f.id, f.filmname, f.description, f.year
             ORDER BY f.id
             OFFSET %s LIMIT %s
         """, (skip, limit))
@@ -88,10 +166,70 @@ def get_films(conn, skip: int = 0, limit: int = 100):
 
         # Round average_rating to 2 decimal places
         for film in films:
-            film['average_rating'] = round(film['average_rating'], 2)
+            _round_rating(film)
 
     return films or [], total_count  # Return an empty list if films is None or empty
 
+@coalesce
+@dispatch
+def get_snapshot_age(conn):
+    """Seconds since the film_card snapshot was refreshed, measured on the server that is read."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp() - refreshedat) AS age FROM film_card_refresh")
+        return float(cur.fetchone()['age'])
+
+@coalesce
+@dispatch
+def get_snapshot_films(conn, skip: int = 0, limit: int = 100, fields: tuple = None):
+    """get_films served from the film_card snapshot, without per-film aggregates."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM film_card")
+        total_count = cur.fetchone()['count']
+        cur.execute(f"""
+            SELECT {_select_list(_pick(FILM_CARD_FIELDS, fields))}
+            FROM film_card fc
+            ORDER BY fc.id
+            OFFSET %s LIMIT %s
+        """, (skip, limit))
+        return cur.fetchall(), total_count
+
+@coalesce
+@dispatch
+def get_snapshot_film(conn, film_id: int, fields: tuple = None):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT {_select_list(_pick(FILM_CARD_FIELDS, fields))}
+            FROM film_card fc
+            WHERE fc.id = %s
+        """, (film_id,))
+        return cur.fetchone()
+
+def refresh_snapshot(conn, min_interval: float, cost_factor: float) -> bool:
+    """Refresh film_card unless another process is at it or did it recently.
+
+    Recently is less than min_interval seconds ago, or less than cost_factor
+    times the duration of the last refresh.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (FILM_CARD_LOCK,))
+        if not cur.fetchone()['locked']:
+            conn.rollback()
+            return False
+        cur.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp() - refreshedat) AS age, duration FROM film_card_refresh")
+        row = cur.fetchone()
+        if row['age'] < max(min_interval, cost_factor * row['duration']):
+            conn.rollback()
+            return False
+        cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY film_card")
+        # now() is the transaction start, a little before the refresh snapshot, so the age errs on the old side
+        cur.execute("""
+            UPDATE film_card_refresh
+            SET refreshedat = now(), duration = EXTRACT(EPOCH FROM clock_timestamp() - now())
+        """)
+        conn.commit()
+        return True
+
+@dispatch
 def create_or_update_review(conn, review_data, film_id, user_id):
     with conn.cursor() as cur:
         # Ensure tengrade is within valid range (1 to 10)
@@ -107,9 +245,9 @@ def create_or_update_review(conn, review_data, film_id, user_id):
             cur.execute("""
                 UPDATE REVIEW 
                 SET ReviewText = %s, TenGrade = %s, BinaryGrade = %s
-                WHERE id = %s
+                WHERE FilmID = %s AND id = %s
                 RETURNING id, ReviewText, TenGrade, BinaryGrade, FilmID, UserID
-            """, (review_data['reviewtext'], tengrade, review_data['binarygrade'], existing_review['id']))
+            """, (review_data['reviewtext'], tengrade, review_data['binarygrade'], film_id, existing_review['id']))
         else:
             cur.execute("""
                 INSERT INTO REVIEW (ReviewText, TenGrade, BinaryGrade, FilmID, UserID)
@@ -158,76 +296,105 @@ def create_or_update_review(conn, review_data, film_id, user_id):
             'user': user
         }
 
-def get_film_reviews(conn, film_id: int, skip: int = 0, limit: int = 100):
+@coalesce
+@dispatch
+def get_film_reviews(conn, film_id: int, skip: int = 0, limit: int = 100, fields: tuple = None):
+    review_columns, film_columns, user_columns = _review_selection(fields)
+    columns = _select_list(review_columns)
+    joins, params = "", []
+    if film_columns is not None:
+        # The film aggregate is computed once, not once per review row
+        columns += ", fc.*"
+        joins += f"""
+            CROSS JOIN (
+                SELECT {_select_list(film_columns, prefix="film_")}
+                FROM film f
+                WHERE f.id = %s
+            ) fc"""
+        params.append(film_id)
+    if user_columns is not None:
+        columns += ", " + _select_list(user_columns, prefix="user_")
+        joins += "\n            JOIN filmuser u ON r.userid = u.id"
+
     with conn.cursor() as cur:
-        cur.execute("""
-            SELECT r.id, r.reviewtext, r.tengrade, r.binarygrade, 
-                   r.userid, u.name as username, u.email, u.role,
-                   f.id as film_id, f.filmname, f.description, f.year,
-                   COALESCE(array_agg(g.genrename) FILTER (WHERE g.genrename IS NOT NULL), ARRAY[]::text[]) as genres,
-                   COALESCE(AVG(r2.tengrade), 0) as average_rating
-            FROM review r
-            JOIN filmuser u ON r.userid = u.id
-            JOIN film f ON r.filmid = f.id
-            LEFT JOIN film_genre fg ON f.id = fg.filmid
-            LEFT JOIN genre g ON fg.genreid = g.id
-            LEFT JOIN review r2 ON f.id = r2.filmid
+        cur.execute(f"""
+            SELECT {columns}
+            FROM review r{joins}
             WHERE r.filmid = %s
-            GROUP BY r.id, u.id, f.id
             ORDER BY r.id
             OFFSET %s LIMIT %s
-        """, (film_id, skip, limit))
-        reviews = cur.fetchall()
-        
+        """, params + [film_id, skip, limit])
         # Restructure the data to match ReviewWithFilmAndUser
-        return [{
-            'id': review['id'],
-            'reviewtext': review['reviewtext'],
-            'tengrade': review['tengrade'],
-            'binarygrade': review['binarygrade'],
-            'film': {
-                'id': review['film_id'],
-                'filmname': review['filmname'],
-                'description': review['description'],
-                'year': review['year'],
-                'genres': review['genres'],
-                'average_rating': round(review['average_rating'], 2)
-            },
-            'user': {
-                'id': review['userid'],
-                'name': review['username'],
-                'email': review['email'],
-                'role': review['role']
-            }
-        } for review in reviews]
+        return [_nest_review(row, film_columns, user_columns) for row in cur.fetchall()]
+
+@coalesce
+@dispatch
+def get_reviews(conn, skip: int = 0, limit: int = 100, fields: tuple = None):
+    review_columns, film_columns, user_columns = _review_selection(fields)
+    columns = [_select_list(review_columns)]
+    joins = ""
+    if film_columns is not None:
+        columns.append(_select_list(film_columns, prefix="film_"))
+        joins += "\n            JOIN film f ON r.filmid = f.id"
+    if user_columns is not None:
+        columns.append(_select_list(user_columns, prefix="user_"))
+        joins += "\n            JOIN filmuser u ON r.userid = u.id"
 
+    with conn.cursor() as cur:
+        # Film aggregates are correlated subqueries, so they are only computed for the page
+        cur.execute(f"""
+            SELECT {", ".join(columns)}
+            FROM (SELECT * FROM review ORDER BY id OFFSET %s LIMIT %s) r{joins}
+            ORDER BY r.id
+        """, (skip, limit))
+        return [_nest_review(row, film_columns, user_columns) for row in cur.fetchall()]
+
+@dispatch
+def get_user_reviews(conn, user_id: int, before: int = None, limit: int = 20):
+    """One page of a user's reviews, newest first, each with a summary of its film.
+
+    Keyset paging on (userid, id): `before` is the id of the last review of
+    the previous page, so deep pages cost the same as the first one.
+    """
+    keyset, params = ("AND r.id < %s", [before]) if before is not None else ("", [])
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT r.id, r.reviewtext, r.tengrade, r.binarygrade,
+                   f.id AS film_id, f.filmname AS film_filmname, f.year AS film_year,
+                   {FILM_RATING} AS film_average_rating
+            FROM review r
+            JOIN film f ON r.filmid = f.id
+            WHERE r.userid = %s {keyset}
+            ORDER BY r.id DESC
+            LIMIT %s
+        """, [user_id] + params + [limit])
+        return [_nest_review(row, ('id', 'filmname', 'year', 'average_rating'), None) for row in cur.fetchall()]
+
+@dispatch
 def get_review(conn, review_id: int):
     with conn.cursor() as cur:
         cur.execute("SELECT * FROM review WHERE id = %s", (review_id,))
         return cur.fetchone()
 
-def update_review(conn, review_id: int, review_data: dict):
+@dispatch
+def update_review(conn, review_id: int, film_id: int, review_data: dict):
     with conn.cursor() as cur:
         cur.execute("""
             UPDATE review
             SET reviewtext = %s, tengrade = %s, binarygrade = %s
-            WHERE id = %s
+            WHERE filmid = %s AND id = %s
             RETURNING id, reviewtext, tengrade, binarygrade, filmid, userid
-        """, (review_data['reviewtext'], review_data['tengrade'], review_data['binarygrade'], review_id))
+        """, (review_data['reviewtext'], review_data['tengrade'], review_data['binarygrade'], film_id, review_id))
         updated_review = cur.fetchone()
 
         if updated_review:
-            cur.execute("""
+            cur.execute(f"""
                 SELECT f.id, f.filmname, f.description, f.year,
-                       COALESCE(array_agg(DISTINCT g.genrename) FILTER (WHERE g.genrename IS NOT NULL), ARRAY[]::text[]) as genres,
-                       COALESCE(AVG(r.tengrade), 0) as average_rating
+                       {FILM_GENRES} as genres,
+                       {FILM_RATING} as average_rating
                 FROM film f
-                LEFT JOIN film_genre fg ON f.id = fg.filmid
-                LEFT JOIN genre g ON fg.genreid = g.id
-                LEFT JOIN review r ON f.id = r.filmid
                 WHERE f.id = %s
-                GROUP BY f.id
-            """, (updated_review['filmid'],))
+            """, (film_id,))
             film = cur.fetchone()
 
             cur.execute("""
@@ -256,7 +423,8 @@ def update_review(conn, review_id: int, review_data: dict):
             }
     return None
 
-def delete_review(conn, review_id: int):
+@dispatch
+def delete_review(conn, review_id: int, film_id: int):
     with conn.cursor() as cur:
         cur.execute("""
             SELECT r.id, r.reviewtext, r.tengrade, r.binarygrade, r.filmid, r.userid,
@@ -265,25 +433,21 @@ def delete_review(conn, review_id: int):
             FROM review r
             JOIN film f ON r.filmid = f.id
             JOIN filmuser u ON r.userid = u.id
-            WHERE r.id = %s
-        """, (review_id,))
+            WHERE r.filmid = %s AND r.id = %s
+        """, (film_id, review_id))
         review_data = cur.fetchone()
 
         if not review_data:
             return None
 
-        cur.execute("DELETE FROM review WHERE id = %s", (review_id,))
+        cur.execute("DELETE FROM review WHERE filmid = %s AND id = %s", (film_id, review_id))
 
-        cur.execute("""
-            SELECT COALESCE(AVG(r.tengrade), 0) as average_rating,
-                   COALESCE(array_agg(DISTINCT g.genrename) FILTER (WHERE g.genrename IS NOT NULL), ARRAY[]::text[]) as genres
+        cur.execute(f"""
+            SELECT {FILM_RATING} as average_rating,
+                   {FILM_GENRES} as genres
             FROM film f
-            LEFT JOIN review r ON f.id = r.filmid
-            LEFT JOIN film_genre fg ON f.id = fg.filmid
-            LEFT JOIN genre g ON fg.genreid = g.id
             WHERE f.id = %s
-            GROUP BY f.id
-        """, (review_data['filmid'],))
+        """, (film_id,))
         film_data = cur.fetchone()
 
         conn.commit()
@@ -309,34 +473,110 @@ def delete_review(conn, review_id: int):
             }
         }
 
-def search_films(conn, name: str = None, genre: str = None, year: int = None):
-    query = """
-        SELECT DISTINCT f.id, f.filmname, f.description, f.year,
-               COALESCE(array_agg(g.genrename) FILTER (WHERE g.genrename IS NOT NULL), ARRAY[]::text[]) as genres,
-               COALESCE(AVG(r.tengrade), 0) as average_rating
+def _search_filters(name: str = None, genre: str = None, year: int = None, decade: int = None):
+    """Build the film search conditions as (name, genre, year) pairs of SQL and params over film f."""
+    name_filter = ("f.filmname ILIKE %s", [f"%{name}%"]) if name else ("TRUE", [])
+    # EXISTS rather than a join so matching films still report all of their genres
+    genre_filter = ("EXISTS (SELECT 1 FROM film_genre fg JOIN genre g ON fg.genreid = g.id "
+                    "WHERE fg.filmid = f.id AND g.genrename = %s)", [genre]) if genre else ("TRUE", [])
+    year_sql, year_params = [], []
+    if year:
+        year_sql.append("f.year = %s")
+        year_params.append(year)
+    if decade is not None:
+        year_sql.append("f.year >= %s AND f.year < %s")
+        year_params += [decade, decade + 10]
+    year_filter = (" AND ".join(year_sql) or "TRUE", year_params)
+    return name_filter, genre_filter, year_filter
+
+@coalesce
+@dispatch
+def search_films(conn, name: str = None, genre: str = None, year: int = None, decade: int = None,
+                 skip: int = 0, limit: int = None, fields: tuple = None):
+    filters = _search_filters(name, genre, year, decade)
+    query = f"""
+        SELECT {_select_list(_pick(FILM_FIELDS, fields))}
         FROM film f
-        LEFT JOIN film_genre fg ON f.id = fg.filmid
-        LEFT JOIN genre g ON fg.genreid = g.id
-        LEFT JOIN review r ON f.id = r.filmid
-        WHERE 1=1
+        WHERE {" AND ".join(sql for sql, _ in filters)}
+        ORDER BY f.id
+        OFFSET %s LIMIT %s
     """
-    params = []
-    if name:
-        query += " AND f.filmname ILIKE %s"
-        params.append(f"%{name}%")
-    if genre:
-        query += " AND g.genrename = %s"
-        params.append(genre)
-    if year:
-        query += " AND f.year = %s"
-        params.append(year)
-    
-    query += " GROUP BY f.id, f.filmname, f.description, f.year"
-    
+    params = [param for _, filter_params in filters for param in filter_params] + [skip, limit]
+
     with conn.cursor() as cur:
         cur.execute(query, params)
         return cur.fetchall()
 
+@coalesce
+@dispatch
+def search_facets(conn, name: str = None, genre: str = None, year: int = None, decade: int = None):
+    """Count matching films per genre and per decade in one pass.
+
+    Facets are disjunctive: genre counts ignore the genre filter and decade
+    counts ignore the year/decade filter, so the sidebar can show how many
+    films each alternative choice would return.
+    """
+    (name_sql, name_params), (genre_sql, genre_params), (year_sql, year_params) = _search_filters(name, genre, year, decade)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH matched AS (
+                SELECT f.id, f.year / 10 * 10 AS decade,
+                       {genre_sql} AS genre_ok,
+                       {year_sql} AS year_ok
+                FROM film f
+                WHERE {name_sql}
+            )
+            SELECT g.genrename AS genre, m.decade,
+                   GROUPING(g.genrename, m.decade) AS grouping_set,
+                   COUNT(DISTINCT m.id) FILTER (WHERE m.year_ok) AS genre_count,
+                   COUNT(DISTINCT m.id) FILTER (WHERE m.genre_ok) AS decade_count,
+                   COUNT(DISTINCT m.id) FILTER (WHERE m.genre_ok AND m.year_ok) AS total
+            FROM matched m
+            LEFT JOIN film_genre fg ON fg.filmid = m.id
+            LEFT JOIN genre g ON fg.genreid = g.id
+            GROUP BY GROUPING SETS ((g.genrename), (m.decade), ())
+        """, genre_params + year_params + name_params)
+        rows = cur.fetchall()
+
+    # GROUPING() sets a bit for every column that is not grouped in the row's set
+    genres = [{'genre': row['genre'], 'count': row['genre_count']}
+              for row in rows if row['grouping_set'] == 1 and row['genre'] is not None and row['genre_count']]
+    decades = [{'decade': row['decade'], 'count': row['decade_count']}
+               for row in rows if row['grouping_set'] == 2 and row['decade_count']]
+    total = next(row['total'] for row in rows if row['grouping_set'] == 3)
+    return {
+        'total': total,
+        'genres': sorted(genres, key=lambda facet: (-facet['count'], facet['genre'])),
+        'decades': sorted(decades, key=lambda facet: facet['decade'])
+    }
+
+@dispatch
+def get_title_popularity(conn, film_ids: list = None):
+    """Titles with review count and rating for the autocomplete index, for some films or the whole catalog."""
+    with conn.cursor() as cur:
+        if film_ids is not None:
+            cur.execute(f"""
+                SELECT f.id, f.filmname, f.year,
+                       (SELECT COUNT(*) FROM review r WHERE r.filmid = f.id) as review_count,
+                       {FILM_RATING} as average_rating
+                FROM film f
+                WHERE f.id = ANY(%s)
+            """, (list(film_ids),))
+        else:
+            cur.execute("""
+                SELECT f.id, f.filmname, f.year,
+                       COALESCE(r.review_count, 0) as review_count,
+                       COALESCE(r.average_rating, 0) as average_rating
+                FROM film f
+                LEFT JOIN (
+                    SELECT filmid, COUNT(*) as review_count, AVG(tengrade) as average_rating
+                    FROM review
+                    GROUP BY filmid
+                ) r ON r.filmid = f.id
+            """)
+        return cur.fetchall()
+
+@dispatch
 def create_genre(conn, genre):
     with conn.cursor() as cur:
         cur.execute("""
@@ -347,11 +587,14 @@ def create_genre(conn, genre):
         conn.commit()
         return cur.fetchone()
 
+@coalesce
+@dispatch
 def get_genres(conn, skip: int = 0, limit: int = 100):
     with conn.cursor() as cur:
         cur.execute("SELECT id, genrename FROM genre OFFSET %s LIMIT %s", (skip, limit))
         return cur.fetchall()
 
+@dispatch
 def add_film_genre(conn, film_id: int, genre_id: int):
     with conn.cursor() as cur:
         cur.execute("""
@@ -362,24 +605,21 @@ def add_film_genre(conn, film_id: int, genre_id: int):
         conn.commit()
         return cur.fetchone()
 
-def get_film(conn, film_id: int):
+@coalesce
+@dispatch
+def get_film(conn, film_id: int, fields: tuple = None):
     with conn.cursor() as cur:
-        cur.execute("""
-            SELECT f.*, 
-                   ARRAY_AGG(DISTINCT g.genrename) AS genres,
-                   COALESCE(AVG(r.tengrade), 0) AS average_rating
+        cur.execute(f"""
+            SELECT {_select_list(_pick(FILM_FIELDS, fields))}
             FROM FILM f
-            LEFT JOIN FILM_GENRE fg ON f.id = fg.filmid
-            LEFT JOIN GENRE g ON fg.genreid = g.id
-            LEFT JOIN REVIEW r ON f.id = r.filmid
             WHERE f.id = %s
-            GROUP BY f.id
         """, (film_id,))
         film = cur.fetchone()
         if film:
-            film['average_rating'] = round(film['average_rating'], 2)  # Округляем до двух знаков после запятой
+            _round_rating(film)  # Округляем до двух знаков после запятой
         return film
 
+@dispatch
 def update_film(conn, film_id: int, film_data: dict):
     with conn.cursor() as cur:
         # Подготовим запрос и параметры
@@ -395,46 +635,33 @@ def update_film(conn, film_id: int, film_data: dict):
             update_fields.append("year = %s")
             params.append(film_data['year'])
         
-        if not update_fields:
-            return None  # Нет данных для обновления
-        
-        update_query = f"""
-            UPDATE film
-            SET {', '.join(update_fields)}
-            WHERE id = %s
-            RETURNING id, filmname, description, year
-        """
-        params.append(film_id)
-        
-        cur.execute(update_query, params)
+        if update_fields:
+            update_query = f"""
+                UPDATE film
+                SET {', '.join(update_fields)}
+                WHERE id = %s
+                RETURNING id, filmname, description, year
+            """
+            params.append(film_id)
+            cur.execute(update_query, params)
+        else:
+            # Genre-only edit: lock the row as UPDATE would, so a concurrent delete can't slip in
+            cur.execute("SELECT id FROM film WHERE id = %s FOR UPDATE", (film_id,))
         updated_film = cur.fetchone()
-        print(f"Updated film: {updated_film}")
+        if updated_film is None:
+            conn.rollback()
+            return None
 
         if 'genres' in film_data:
-            cur.execute("DELETE FROM film_genre WHERE filmid = %s", (film_id,))
-            print(f"Deleted film genres for film {film_id}")
-            
-            for genre_name in film_data['genres']:
-                cur.execute("SELECT id FROM genre WHERE genrename = %s", (genre_name,))
-                genre = cur.fetchone()
-                if genre:
-                    cur.execute("INSERT INTO film_genre (filmid, genreid) VALUES (%s, %s)", (film_id, genre['id']))
-                else:
-                    cur.execute("INSERT INTO genre (genrename) VALUES (%s) RETURNING id", (genre_name,))
-                    new_genre_id = cur.fetchone()['id']
-                    cur.execute("INSERT INTO film_genre (filmid, genreid) VALUES (%s, %s)", (film_id, new_genre_id))
-                print(f"Added film genre {genre_name} for film {film_id}")
+            # Diff-based sync in one round trip, see sync_film_genres in V0004
+            cur.execute("SELECT sync_film_genres(%s, %s::text[])", (film_id, film_data['genres'] or []))
 
-        cur.execute("""
-            SELECT f.id, f.filmname, f.description, f.year, 
-                   COALESCE(array_agg(g.genrename) FILTER (WHERE g.genrename IS NOT NULL), ARRAY[]::text[]) as genres,
-                   COALESCE(AVG(r.tengrade), 0) as average_rating
+        cur.execute(f"""
+            SELECT f.id, f.filmname, f.description, f.year,
+                   {FILM_GENRES} as genres,
+                   {FILM_RATING} as average_rating
             FROM film f
-            LEFT JOIN film_genre fg ON f.id = fg.filmid
-            LEFT JOIN genre g ON fg.genreid = g.id
-            LEFT JOIN review r ON f.id = r.filmid
             WHERE f.id = %s
-            GROUP BY f.id, f.filmname, f.description, f.year
         """, (film_id,))
         updated_film_with_genres = cur.fetchone()
         updated_film_with_genres['average_rating'] = round(updated_film_with_genres['average_rating'], 2)
@@ -442,6 +669,7 @@ def update_film(conn, film_id: int, film_data: dict):
         conn.commit()
         return updated_film_with_genres
 
+@dispatch
 def delete_film(conn, film_id: int):
     with conn.cursor() as cur:
         cur.execute("DELETE FROM film_genre WHERE filmid = %s", (film_id,))
@@ -458,12 +686,14 @@ def authenticate_user(conn, email: str, password: str):
         return False
     return user
 
+@dispatch
 def get_user_role(conn, user_id: int):
     with conn.cursor() as cur:
         cur.execute("SELECT role FROM filmuser WHERE id = %s", (user_id,))
         result = cur.fetchone()
         return result['role'] if result else None
 
+@dispatch
 def update_genre(conn, genre_id: int, genre_data: dict):
     with conn.cursor() as cur:
         cur.execute("""
@@ -476,6 +706,7 @@ def update_genre(conn, genre_id: int, genre_data: dict):
         conn.commit()
         return updated_genre
 
+@dispatch
 def delete_genre(conn, genre_id: int):
     with conn.cursor() as cur:
         cur.execute("DELETE FROM film_genre WHERE genreid = %s", (genre_id,))
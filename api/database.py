@@ -1,12 +1,235 @@
+import itertools
+from collections import Counter
+from contextlib import contextmanager
+import threading
+import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from fastapi import Request
+import admission
+import deadlines
+import metrics
+import profiling
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Comma-separated DSNs of streaming replicas used by read-only routes.
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()]
+# How long a replica that failed to connect is skipped before it is tried again.
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+# A pooled replica connection idle for longer than this is pinged before it is handed out.
+REPLICA_CHECK_IDLE_SECONDS = float(os.getenv("REPLICA_CHECK_IDLE_SECONDS", "10"))
+# Connections kept open per server (primary and each replica) and API process, and
+# handed out at most at once. The maximum covers every request admission control lets
+# in at once, plus DB_POOL_MIN for background work and routes that also read the
+# primary, so one-off connections past it are an exception rather than the load path.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "4"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", str(admission.total_concurrency() + DB_POOL_MIN)))
 
-def get_db():
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+_replica_cycle = itertools.cycle(DATABASE_READ_URLS)
+_replica_down_until = {}
+_replica_lock = threading.Lock()
+
+def _next_replica():
+    with _replica_lock:
+        return next(_replica_cycle)
+
+def connect():
+    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+
+# One pool per server, keyed by DSN. Checked-out connections are tracked here rather
+# than through the pool's internals, so release() knows where each one came from.
+_pools = {}
+_checked_out = {}  # id(conn) -> DSN of its pool
+_released_at = {}  # id(conn) -> when a pooled replica connection was last returned
+_pools_lock = threading.Lock()
+_opening = {}  # DSN -> lock held while that server's pool connects
+
+def _pool(dsn: str, **connect_kwargs):
+    """The pool of a server, opened with its DB_POOL_MIN connections on first use."""
+    pool = _pools.get(dsn)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        opening = _opening.setdefault(dsn, threading.Lock())
+    # Connecting may take up to the connect timeout, so only users of this server wait
+    # for it: _pools_lock guards every checkout and release, and pool_state() in /readyz
+    with opening:
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, dsn, cursor_factory=RealDictCursor, **connect_kwargs)
+            with _pools_lock:
+                _pools[dsn] = pool
+    return pool
+
+def _replica_pool(url: str):
+    return _pool(url, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+
+def _checkout(dsn: str, pool):
+    try:
+        conn = pool.getconn()
+    except PoolError:
+        metrics.incr("db.pool.exhausted")
+        return None
+    with _pools_lock:
+        _checked_out[id(conn)] = dsn
+    return conn
+
+def open_pool():
+    """Open the primary pool and one per replica, a replica that is down is retried on use."""
+    _pool(DATABASE_URL)
+    for url in DATABASE_READ_URLS:
+        try:
+            _replica_pool(url)
+        except psycopg2.OperationalError as e:
+            print(f"Replica pool not opened, will retry on use: {e}")
+
+def close_pool():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        _checked_out.clear()
+        _released_at.clear()
+    for pool in pools:
+        pool.closeall()
+
+def pool_state():
+    with _pools_lock:
+        in_use = Counter(_checked_out.values())
+        servers = [("primary" if dsn == DATABASE_URL else f"replica{DATABASE_READ_URLS.index(dsn) + 1}", dsn)
+                   for dsn in _pools]
+    if not servers:
+        return {'open': False}
+    return {'open': True, 'size': DB_POOL_MIN, 'max': DB_POOL_MAX,
+            'in_use': {name: in_use[dsn] for name, dsn in servers}}
+
+metrics.gauge("db.pool.in_use", lambda: len(_checked_out))
+
+def _mark_replica_down(url: str, reason):
+    print(f"Replica unavailable, skipping for {REPLICA_RETRY_SECONDS}s: {reason}")
+    _replica_down_until[url] = time.monotonic() + REPLICA_RETRY_SECONDS
+    # Its other pooled connections are as dead as this one, the pool is reopened on the next try
+    with _pools_lock:
+        pool = _pools.pop(url, None)
+    if pool is not None:
+        metrics.incr("db.pool.replica_dropped")
+        pool.closeall()
+
+def _check_idle(conn):
+    # A connection that sat in the pool may have lost its server meanwhile, a ping is
+    # cheaper than failing the request that gets it
+    with _pools_lock:
+        idle_since = _released_at.pop(id(conn), None)
+    if idle_since is None or time.monotonic() - idle_since < REPLICA_CHECK_IDLE_SECONDS:
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    conn.rollback()
+
+def connect_replica():
+    """A pooled connection to the next healthy replica in round-robin order, or None if all are down."""
+    for _ in range(len(DATABASE_READ_URLS)):
+        url = _next_replica()
+        if _replica_down_until.get(url, 0) > time.monotonic():
+            continue
+        conn = None
+        try:
+            conn = _checkout(url, _replica_pool(url))
+            if conn is None:
+                return psycopg2.connect(url, cursor_factory=RealDictCursor, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+            if conn.readonly is not True:
+                conn.set_session(readonly=True)
+            _check_idle(conn)
+        except psycopg2.OperationalError as e:
+            _mark_replica_down(url, e)
+            if conn is not None:
+                release(conn)
+            continue
+        _replica_down_until.pop(url, None)
+        return conn
+    return None
+
+def acquire():
+    """A primary connection from the pool, or a one-off one when the pool is exhausted."""
+    return _checkout(DATABASE_URL, _pool(DATABASE_URL)) or connect()
+
+def release(conn):
+    with _pools_lock:
+        dsn = _checked_out.pop(id(conn), None)
+        pool = _pools.get(dsn)
+    if pool is None:
+        # One-off connection, or its pool was closed meanwhile
+        conn.close()
+        return
+    broken = bool(conn.closed)
+    if not broken:
+        try:
+            # Ends whatever the request left open, SET LOCAL included, and drops per-request cursor hooks
+            conn.rollback()
+            conn.cursor_factory = RealDictCursor
+        except psycopg2.Error:
+            broken = True
+    try:
+        pool.putconn(conn, close=broken)
+    except PoolError:
+        # The pool was closed meanwhile
+        conn.close()
+    if dsn == DATABASE_URL:
+        return
+    if broken:
+        _mark_replica_down(dsn, "pooled connection lost")
+    elif not conn.closed:
+        with _pools_lock:
+            _released_at[id(conn)] = time.monotonic()
+
+@contextmanager
+def primary():
+    """A pooled primary connection for work outside a route's own connection."""
+    conn = acquire()
+    try:
+        yield conn
+    finally:
+        release(conn)
+
+@contextmanager
+def every_pooled_connection():
+    """DB_POOL_MIN connections of each open pool at once, to run something on every kept backend."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    connections = []
+    try:
+        for dsn, pool in pools:
+            for _ in range(DB_POOL_MIN):
+                conn = _checkout(dsn, pool)
+                if conn is not None:
+                    connections.append(conn)
+        yield connections
+    finally:
+        for conn in connections:
+            release(conn)
+
+def get_db(request: Request):
+    conn = acquire()
+    profiling.instrument(conn)
+    try:
+        deadlines.apply(conn, request)
+        yield conn
+    finally:
+        deadlines.forget(conn, request)
+        release(conn)
+
+def get_read_db(request: Request):
+    # Read-only routes go to a replica when one is configured and reachable,
+    # otherwise they fall back to the primary. Cache fills right after an
+    # invalidation use the primary, see CompressionMiddleware.
+    read_primary = getattr(request.state, "read_primary", False)
+    conn = (None if read_primary else connect_replica()) or acquire()
+    profiling.instrument(conn)
     try:
+        deadlines.apply(conn, request)
         yield conn
     finally:
-        conn.close()
\ No newline at end of file
+        deadlines.forget(conn, request)
+        release(conn)
@@ -0,0 +1,80 @@
+import asyncio
+import contextvars
+import os
+import threading
+import anyio
+from fastapi import Request
+import metrics
+
+# How often an in-flight request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.25"))
+
+_request_state = contextvars.ContextVar("request_state", default=None)
+
+def query_deadline(seconds: float):
+    """Build a dependency that limits the route's statements to `seconds` and cancels them when the client disconnects.
+
+    The watcher reads from the request stream, so it is only meant for routes
+    without a request body. get_db and get_read_db pick the deadline up from
+    request.state and register their connections for cancellation.
+    """
+    async def watch(request: Request):
+        request.state.query_deadline = seconds
+        request.state.db_connections = []
+        # Held while cancelling and while a connection is handed back, so a late cancel
+        # never reaches a connection that already serves another request
+        request.state.db_connections_lock = threading.Lock()
+        request.state.client_disconnected = False
+        _request_state.set(request.state)
+        watcher = asyncio.create_task(_cancel_on_disconnect(request))
+        try:
+            yield
+        finally:
+            watcher.cancel()
+    return watch
+
+async def _cancel_on_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    request.state.client_disconnected = True
+    # PQcancel opens a connection to the server and waits for it, keep it off the event loop
+    await anyio.to_thread.run_sync(_cancel_all, request.state)
+
+def _cancel_all(state):
+    with state.db_connections_lock:
+        for conn in state.db_connections:
+            if not conn.closed:
+                # Sends a cancel request for whatever statement the backend is running
+                conn.cancel()
+
+def apply(conn, request: Request):
+    """Set the route's statement timeout on the request's connection and register it for cancellation."""
+    deadline = getattr(request.state, "query_deadline", None)
+    if deadline is None:
+        return
+    with request.state.db_connections_lock:
+        request.state.db_connections.append(conn)
+    with conn.cursor() as cur:
+        # SET LOCAL only lasts for the current transaction, so it never leaks into a later request
+        cur.execute("SET LOCAL statement_timeout = %s", (int(deadline * 1000),))
+
+def forget(conn, request: Request):
+    """Stop cancelling on behalf of this request, the connection goes back to the pool and serves others.
+
+    Waits for a cancel in progress, so once this returns the connection can be released.
+    """
+    lock = getattr(request.state, "db_connections_lock", None)
+    if lock is None:
+        return
+    with lock:
+        if conn in request.state.db_connections:
+            request.state.db_connections.remove(conn)
+
+def client_disconnected() -> bool:
+    """Whether the client of the request being handled in this context has gone away."""
+    state = _request_state.get()
+    return state is not None and state.client_disconnected
+
+def record_cancellation(request: Request):
+    reason = "disconnect" if getattr(request.state, "client_disconnected", False) else "deadline"
+    metrics.incr(f"queries.cancelled.{reason}")
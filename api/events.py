@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import threading
+from collections import defaultdict
+import metrics
+
+# Open event streams per API process, each holds a socket and a small queue
+MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "2000"))
+# Events buffered for a slow client before its backlog is replaced by one resync
+QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "32"))
+# Comment lines keep idle streams alive through proxies
+HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+RETRY = "retry: 5000\n\n"
+HEARTBEAT = ": keepalive\n\n"
+RESYNC = "event: resync\ndata: {}\n\n"
+
+class TooManySubscribers(Exception):
+    pass
+
+class Subscriber:
+    def __init__(self, film_id: int, loop: asyncio.AbstractEventLoop):
+        self.film_id = film_id
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def put(self, message: str):
+        """Queue a message, runs on the subscriber's event loop."""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # The client can't keep up: drop what it hasn't read and have it refetch the film instead
+            metrics.incr("events.resyncs")
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+_subscribers = defaultdict(set)  # film id -> subscribers
+_count = 0
+_lock = threading.Lock()
+
+metrics.gauge("events.subscribers", lambda: _count)
+
+def subscribe(film_id: int) -> Subscriber:
+    global _count
+    subscriber = Subscriber(film_id, asyncio.get_running_loop())
+    with _lock:
+        if _count >= MAX_SUBSCRIBERS:
+            metrics.incr("events.rejected")
+            raise TooManySubscribers()
+        _subscribers[film_id].add(subscriber)
+        _count += 1
+    return subscriber
+
+def unsubscribe(subscriber: Subscriber):
+    global _count
+    with _lock:
+        subscribers = _subscribers.get(subscriber.film_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.remove(subscriber)
+        if not subscribers:
+            del _subscribers[subscriber.film_id]
+        _count -= 1
+
+def _deliver(subscribers, message: str):
+    for subscriber in subscribers:
+        subscriber.put(message)
+
+def _fan_out(subscribers, message: str):
+    # One callback per event loop rather than one per subscriber
+    by_loop = defaultdict(list)
+    for subscriber in subscribers:
+        by_loop[subscriber.loop].append(subscriber)
+    for loop, loop_subscribers in by_loop.items():
+        try:
+            loop.call_soon_threadsafe(_deliver, loop_subscribers, message)
+        except RuntimeError:
+            pass  # the loop is closed, its streams are gone
+
+def publish(film_id: int, name: str, data: dict):
+    """Send an event to every stream of the film. Thread-safe, the message is encoded once for all of them."""
+    with _lock:
+        subscribers = list(_subscribers.get(film_id, ()))
+    if not subscribers:
+        return
+    metrics.incr("events.published")
+    event_id = data.get("id")
+    header = f"id: {event_id}\n" if event_id is not None else ""
+    _fan_out(subscribers, f"{header}event: {name}\ndata: {json.dumps(data)}\n\n")
+
+def resync_all():
+    """Tell every stream that events may have been missed, clients then refetch."""
+    with _lock:
+        subscribers = [subscriber for film_subscribers in _subscribers.values() for subscriber in film_subscribers]
+    _fan_out(subscribers, RESYNC)
+
+def at_capacity() -> bool:
+    return _count >= MAX_SUBSCRIBERS
+
+async def stream(film_id: int):
+    """Server-Sent Events of one film until the client goes away.
+
+    The subscription is made here rather than by the route, so it is always
+    released: a generator that never started has nothing to clean up.
+    """
+    try:
+        subscriber = subscribe(film_id)
+    except TooManySubscribers:
+        return  # lost the race for the last slot, the client reconnects later
+    try:
+        yield RETRY
+        while True:
+            try:
+                yield await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+    finally:
+        unsubscribe(subscriber)
@@ -0,0 +1,118 @@
+import json
+import os
+import select
+import threading
+from collections import defaultdict
+import psycopg2
+from database import DATABASE_URL
+
+CHANNEL = "filmdb_changes"
+RECONNECT_MIN_SECONDS = float(os.getenv("LISTENER_RECONNECT_MIN_SECONDS", "0.5"))
+RECONNECT_MAX_SECONDS = float(os.getenv("LISTENER_RECONNECT_MAX_SECONDS", "30"))
+# Idle connections are pinged this often so a dead socket is noticed quickly
+KEEPALIVE_SECONDS = float(os.getenv("LISTENER_KEEPALIVE_SECONDS", "10"))
+
+_handlers = defaultdict(list)
+_flush_handlers = []
+_stop = threading.Event()
+_thread = None
+_connected = threading.Event()
+
+def on_change(*tables):
+    """Register a handler called with the decoded event for changes to the given tables."""
+    def decorator(fn):
+        for table in tables:
+            _handlers[table].append(fn)
+        return fn
+    return decorator
+
+def on_flush(fn):
+    """Register a handler that drops all local state, called whenever events may have been missed."""
+    _flush_handlers.append(fn)
+    return fn
+
+def is_connected():
+    return _connected.is_set()
+
+def flush(reason: str):
+    print(f"Flushing local state: {reason}")
+    for handler in _flush_handlers:
+        try:
+            handler()
+        except Exception as e:
+            print(f"Flush handler {handler.__name__} failed: {e}")
+
+def touches(event, *columns) -> bool:
+    """Whether the event may concern the given columns: inserts, deletes, and updates that changed one of them."""
+    changed = event.get("changed")
+    return event.get("op") != "UPDATE" or changed is None or any(column in changed for column in columns)
+
+def dispatch(payload: str):
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        print(f"Ignoring malformed change event: {payload[:100]}")
+        return
+    if event.get("op") == "TRUNCATE":
+        flush(f"{event.get('table')} truncated")
+        return
+    for handler in _handlers.get(event.get("table"), []):
+        try:
+            handler(event)
+        except Exception as e:
+            # A broken handler must not leave its state stale, drop everything instead
+            print(f"Change handler {handler.__name__} failed: {e}")
+            flush("handler error")
+
+def _listen(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {CHANNEL}")
+    _connected.set()
+    # Anything could have changed while we were not listening
+    flush("listener connected")
+    while not _stop.is_set():
+        if select.select([conn], [], [], KEEPALIVE_SECONDS) == ([], [], []):
+            # Notifications that arrive during the ping are queued by psycopg2 without
+            # touching the socket again, so they have to be drained here as well
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        else:
+            conn.poll()
+        _drain(conn)
+
+def _drain(conn):
+    while conn.notifies:
+        dispatch(conn.notifies.pop(0).payload)
+
+def _run():
+    delay = RECONNECT_MIN_SECONDS
+    while not _stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_session(autocommit=True)
+            delay = RECONNECT_MIN_SECONDS
+            _listen(conn)
+        except (psycopg2.Error, OSError) as e:
+            print(f"Change listener disconnected, retrying in {delay}s: {e}")
+        finally:
+            _connected.clear()
+            if conn is not None:
+                conn.close()
+        _stop.wait(delay)
+        delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+def start():
+    global _thread
+    if _thread is not None or not DATABASE_URL:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="change-listener", daemon=True)
+    _thread.start()
+
+def stop():
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=1)
+        _thread = None
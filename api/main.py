@@ -1,23 +1,199 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Response
+from fastapi import FastAPI, Depends, HTTPException, status, Response, Request, Query
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional
-from database import get_db
-import schemas, crud
+from database import get_db, get_read_db, primary, close_pool, pool_state
+from fastapi.concurrency import run_in_threadpool
+from cache import LocalCache
+import os
+import schemas, crud, listener, admission, metrics, singleflight, autocomplete, deadlines, compression, snapshot, events, profiling, warmup
 from crud import authenticate_user
 from psycopg2.extras import RealDictConnection
+from psycopg2.errors import QueryCanceled
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    listener.start()
+    snapshot.start()
+    warmup.start()
+    yield
+    warmup.stop()
+    snapshot.stop()
+    listener.stop()
+    close_pool()
+
+app = FastAPI(lifespan=lifespan)
+# Lets profiled requests be split into dependencies, endpoint and serialization
+app.router.route_class = profiling.ProfiledRoute
 
 SECRET_KEY = "your-secret-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 FILMADMIN = "filmadmin"
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+FACET_CACHE_TTL = float(os.getenv("FACET_CACHE_TTL", "300"))
+# Statement time budgets for read routes, well below the server-wide statement_timeout
+LISTING_DEADLINE = float(os.getenv("QUERY_DEADLINE_LISTING", "5"))
+LOOKUP_DEADLINE = float(os.getenv("QUERY_DEADLINE_LOOKUP", "2"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Users resolved from tokens, keyed by email. Any filmuser change clears it in every worker.
+principal_cache = LocalCache(ttl=PRINCIPAL_CACHE_TTL)
+
+@listener.on_change("filmuser")
+def invalidate_principals(event):
+    principal_cache.clear()
+
+listener.on_flush(principal_cache.clear)
+
+@listener.on_change("film", "genre", "film_genre", "review", "filmuser")
+def detach_shared_queries(event):
+    singleflight.forget_all()
+
+listener.on_flush(singleflight.forget_all)
+
+facet_cache = LocalCache(ttl=FACET_CACHE_TTL)
+
+@listener.on_change("genre", "film_genre")
+def invalidate_facets(event):
+    facet_cache.clear()
+
+@listener.on_change("film")
+def invalidate_facets_on_film_change(event):
+    # Rating updates arrive on every review write and don't move any facet
+    if listener.touches(event, "year"):
+        facet_cache.clear()
+
+listener.on_flush(facet_cache.clear)
+
+@warmup.step("facets")
+def warm_facets():
+    generation = facet_cache.generation
+    with primary() as conn:
+        facet_cache.set("catalog", crud.search_facets(conn), generation)
+
+# Cached listing pages embed films, genres, reviews and reviewer names, see compression.CACHEABLE_PATHS.
+# Pages served from the film_card snapshot are only dropped when it is refreshed.
+@listener.on_change("review")
+def invalidate_review_responses(event):
+    compression.invalidate("films", "reviews", f"film:{event['filmid']}")
+
+@listener.on_change("film")
+def invalidate_film_responses(event):
+    # The rating trigger's update arrives together with the review event, which dropped the pages already
+    if listener.touches(event, "filmname", "year", "description"):
+        compression.invalidate("films", "reviews", f"film:{event['id']}")
+
+@listener.on_change("genre", "film_genre")
+def invalidate_genre_responses(event):
+    compression.invalidate()
+
+@listener.on_change("filmuser")
+def invalidate_reviewer_responses(event):
+    # A new user has no reviews yet, and password changes don't show on any page
+    if event["op"] != "INSERT" and listener.touches(event, "email", "name", "gender", "dateofbirth", "role"):
+        compression.invalidate("reviews", "film_reviews")
+
+listener.on_flush(compression.invalidate)
+
+@listener.on_change("film", "genre", "film_genre", "review")
+def count_snapshot_changes(event):
+    # A review write is counted by its review event, not again by the rating trigger's film update
+    if event["table"] != "film" or listener.touches(event, "filmname", "year", "description"):
+        snapshot.record_change()
+
+listener.on_flush(snapshot.request_refresh)
+
+# Review events carry the film's new rating and review count, see V0009
+REVIEW_EVENT_KEYS = ("op", "id", "userid", "tengrade", "binarygrade", "average_rating", "review_count")
+
+@listener.on_change("review")
+def publish_review_event(event):
+    events.publish(event["filmid"], "review", {key: event.get(key) for key in REVIEW_EVENT_KEYS})
+
+listener.on_flush(events.resync_all)
+
+@listener.on_change("film")
+def refresh_autocomplete(event):
+    # Popularity follows the periodic rebuild, so the rating trigger's updates are ignored
+    if autocomplete.index.loaded_at is None or not listener.touches(event, "filmname", "year"):
+        return
+    if event["op"] == "DELETE":
+        autocomplete.index.remove(event["id"])
+        return
+    autocomplete.refresh_later(event["id"], primary)
+
+@listener.on_flush
+def reload_autocomplete():
+    # Rebuilt rather than emptied, so suggestions keep working meanwhile
+    if autocomplete.index.loaded_at is not None:
+        autocomplete.reload(primary)
+
+def bearer_token(authorization: str):
+    return authorization[7:] if authorization.lower().startswith("bearer ") else None
+
+def token_email(token: str):
+    """Email a token of ours was issued to, None for a bad or expired token."""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+def user_for_token(token: str, connect):
+    """User a token was issued to, None for a bad token or an unknown user.
+
+    Users come from the principal cache, connect() is only entered on a miss.
+    """
+    email = token_email(token)
+    if email is None:
+        return None
+    # Without a live listener we would not hear about role changes, so skip the cache
+    user = principal_cache.get(email) if listener.is_connected() else None
+    if user is None:
+        generation = principal_cache.generation
+        with connect() as conn:
+            user = crud.get_user_by_email(conn, email=email)
+        if user is None:
+            print(f"User not found for email: {email}")
+            return None
+        principal_cache.set(email, user, generation)
+    return user
+
+def rate_limit_key(request: Request):
+    # Authenticated clients get their own bucket, everyone else is limited per IP
+    token = bearer_token(request.headers.get("authorization", ""))
+    email = token_email(token) if token else None
+    if email:
+        return f"user:{email}"
+    return f"ip:{admission.client_ip(request)}"
+
+admit_read = Depends(admission.limit(admission.READ, rate_limit_key))
+admit_aggregate = Depends(admission.limit(admission.AGGREGATE, rate_limit_key))
+admit_write = Depends(admission.limit(admission.WRITE, rate_limit_key))
+admit_login = Depends(admission.limit(admission.LOGIN, rate_limit_key))
+
+deadline_listing = Depends(deadlines.query_deadline(LISTING_DEADLINE))
+deadline_lookup = Depends(deadlines.query_deadline(LOOKUP_DEADLINE))
+
+def field_selection(allowed):
+    """Build a dependency parsing ?fields=a,b into a sorted tuple of field names, None when absent."""
+    def parse(fields: Optional[str] = Query(None, description="Comma-separated fields to return, all when omitted")):
+        if fields is None:
+            return None
+        names = {name.strip() for name in fields.split(",") if name.strip()}
+        unknown = sorted(names - set(allowed))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        return tuple(sorted(names))
+    return parse
+
+film_fields = Depends(field_selection(crud.FILM_FIELDS))
+review_fields = Depends(field_selection(crud.REVIEW_FIELD_NAMES))
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -30,31 +206,26 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+@profiling.timed("auth")
 def get_current_user(token: str = Depends(oauth2_scheme), conn: RealDictConnection = Depends(get_db)):
     print(f"Attempting to get current user with token: {token[:10]}...")
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"Token decoded successfully. Payload: {payload}")
-        email = payload.get("sub")
-        print(f"Extracted email: {email}")
-        if email is None:
-            print("Email not found in token payload")
-            raise credentials_exception
-    except JWTError as e:
-        print(f"JWT decode error: {str(e)}")
-        raise credentials_exception
-    user = crud.get_user_by_email(conn, email=email)
+    user = user_for_token(token, lambda: nullcontext(conn))
     if user is None:
-        print(f"User not found for email: {email}")
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     print(f"User found: {user['email']}")
+    profiling.note_user(user)
     return user
 
+def profile_owner(authorization: str):
+    """User behind the token of a request asking to be profiled, None for a bad token."""
+    token = bearer_token(authorization)
+    return user_for_token(token, primary) if token else None
+
+@profiling.timed("auth")
 def check_filmadmin(current_user: dict = Depends(get_current_user), conn: RealDictConnection = Depends(get_db)):
     print(f"Checking filmadmin for user: {current_user}")
     user_role = crud.get_user_role(conn, current_user['id'])
@@ -63,7 +234,7 @@ def check_filmadmin(current_user: dict = Depends(get_current_user), conn: RealDi
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
     return current_user
 
-@app.post("/token")
+@app.post("/token", dependencies=[admit_login])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), conn: RealDictConnection = Depends(get_db)):
     try:
         user = authenticate_user(conn, form_data.username, form_data.password)
@@ -82,7 +253,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         print(f"Login error: {str(e)}")
         raise
 
-@app.post("/users/", response_model=schemas.User)
+@app.post("/users/", response_model=schemas.User, dependencies=[admit_login])
 def create_user(user: schemas.UserCreate, conn: RealDictConnection = Depends(get_db)):
     db_user = crud.get_user_by_email(conn, email=user.email)
     if db_user:
@@ -92,53 +263,149 @@ def create_user(user: schemas.UserCreate, conn: RealDictConnection = Depends(get
     except ValueError as e:
         raise HTTPException(status_code=403, detail=str(e))
 
-@app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, conn: RealDictConnection = Depends(get_db)):
+@app.get("/users/", response_model=List[schemas.User], dependencies=[admit_read, deadline_lookup])
+def read_users(skip: int = 0, limit: int = 100, conn: RealDictConnection = Depends(get_read_db)):
     users = crud.get_users(conn, skip=skip, limit=limit)
     return users
 
-@app.post("/films/", response_model=schemas.Film)
+@app.post("/films/", response_model=schemas.Film, dependencies=[admit_write])
 def create_film(film: schemas.FilmCreate, conn: RealDictConnection = Depends(get_db), current_user: dict = Depends(check_filmadmin)):
     return crud.create_film(conn=conn, film=film)
 
-@app.get("/films/", response_model=List[schemas.Film])
-def read_films(response: Response, skip: int = 0, limit: int = 100, conn: RealDictConnection = Depends(get_db)):
-    films, total_count = crud.get_films(conn, skip=skip, limit=limit)
+@app.get("/films/", response_model=List[schemas.FilmPartial], response_model_exclude_unset=True,
+         dependencies=[admit_aggregate, deadline_listing])
+def read_films(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[tuple] = film_fields,
+    max_staleness: Optional[float] = Query(None, ge=0),
+    conn: RealDictConnection = Depends(get_read_db)
+):
+    snapshot_age = snapshot.age_for(request, conn, max_staleness)
+    if snapshot_age is not None:
+        films, total_count = crud.get_snapshot_films(conn, skip=skip, limit=limit, fields=fields)
+        response.headers["X-Snapshot-Age"] = f"{snapshot_age:.1f}"
+    else:
+        films, total_count = crud.get_films(conn, skip=skip, limit=limit, fields=fields)
     response.headers["X-Total-Count"] = str(total_count)
     return films
 
-@app.get("/reviews/", response_model=List[schemas.Review])
-def read_reviews(skip: int = 0, limit: int = 100, conn: RealDictConnection = Depends(get_db)):
-    reviews = crud.get_reviews(conn, skip=skip, limit=limit)
+@app.get("/reviews/", response_model=List[schemas.ReviewPartial], response_model_exclude_unset=True,
+         dependencies=[admit_aggregate, deadline_listing])
+def read_reviews(skip: int = 0, limit: int = 100, fields: Optional[tuple] = review_fields,
+                 conn: RealDictConnection = Depends(get_read_db)):
+    reviews = crud.get_reviews(conn, skip=skip, limit=limit, fields=fields)
     return reviews
 
-@app.get("/films/search/", response_model=List[schemas.Film])
-def search_films(name: str = None, genre: str = None, year: int = None, conn: RealDictConnection = Depends(get_db)):
-    return crud.search_films(conn, name=name, genre=genre, year=year)
+@app.get("/films/search/", response_model=List[schemas.FilmPartial], response_model_exclude_unset=True,
+         dependencies=[admit_aggregate, deadline_listing])
+def search_films(name: str = None, genre: str = None, year: int = None, decade: int = None,
+                 fields: Optional[tuple] = film_fields, conn: RealDictConnection = Depends(get_read_db)):
+    return crud.search_films(conn, name=name, genre=genre, year=year, decade=decade, fields=fields)
 
-@app.get("/users/me", response_model=schemas.User)
+@app.get("/films/search/facets", response_model=schemas.FacetedSearchResult, dependencies=[admit_aggregate, deadline_listing])
+def search_films_with_facets(
+    name: str = None,
+    genre: str = None,
+    year: int = None,
+    decade: int = None,
+    skip: int = 0,
+    limit: int = 100,
+    conn: RealDictConnection = Depends(get_read_db)
+):
+    # Facets of the whole catalog are the same for every visitor, keep them until the catalog changes
+    cacheable = not (name or genre or year or decade is not None) and listener.is_connected()
+    facets = facet_cache.get("catalog") if cacheable else None
+    if facets is None and cacheable:
+        # Filled from the primary: a lagging replica would pin pre-write facets for the whole TTL
+        generation = facet_cache.generation
+        with primary() as primary_conn:
+            facets = crud.search_facets(primary_conn)
+        facet_cache.set("catalog", facets, generation)
+    elif facets is None:
+        facets = crud.search_facets(conn, name=name, genre=genre, year=year, decade=decade)
+    results = crud.search_films(conn, name=name, genre=genre, year=year, decade=decade, skip=skip, limit=limit)
+    return {
+        "results": results,
+        "total": facets["total"],
+        "facets": {"genres": facets["genres"], "decades": facets["decades"]}
+    }
+
+@app.get("/films/autocomplete", response_model=List[schemas.FilmSuggestion], dependencies=[admit_read])
+def autocomplete_films(q: str, limit: int = Query(10, ge=1, le=autocomplete.MAX_SUGGESTIONS)):
+    # Served from memory, the database is only touched to (re)build the index
+    autocomplete.ensure_loaded(primary)
+    return autocomplete.index.search(q, limit)
+
+@app.get("/users/me", response_model=schemas.User, dependencies=[admit_read])
 def read_users_me(current_user: dict = Depends(get_current_user)):
     return current_user
 
-@app.post("/genres/", response_model=schemas.Genre)
+def user_reviews_page(response: Response, conn, user_id: int, before: Optional[int], limit: int):
+    # One extra row tells whether there is a next page
+    reviews = crud.get_user_reviews(conn, user_id, before=before, limit=limit + 1)
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        response.headers["X-Next-Cursor"] = str(reviews[-1]['id'])
+    return reviews
+
+@app.get("/users/me/reviews", response_model=List[schemas.UserReview], dependencies=[admit_aggregate, deadline_listing])
+def read_my_reviews(
+    response: Response,
+    before: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: dict = Depends(get_current_user),
+    conn: RealDictConnection = Depends(get_read_db)
+):
+    return user_reviews_page(response, conn, current_user['id'], before, limit)
+
+@app.get("/users/{user_id}/reviews", response_model=List[schemas.UserReview], dependencies=[admit_aggregate, deadline_listing])
+def read_user_reviews(
+    user_id: int,
+    response: Response,
+    before: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    conn: RealDictConnection = Depends(get_read_db)
+):
+    return user_reviews_page(response, conn, user_id, before, limit)
+
+@app.post("/genres/", response_model=schemas.Genre, dependencies=[admit_write])
 def create_genre(genre: schemas.GenreCreate, conn: RealDictConnection = Depends(get_db), current_user: dict = Depends(check_filmadmin)):
     print(f"Attempting to create genre {genre}")
     print(f"Creating genre {genre} by user {current_user['email']}")
     return crud.create_genre(conn, genre)
 
-@app.get("/genres/", response_model=List[schemas.Genre])
-def read_genres(skip: int = 0, limit: int = 100, conn: RealDictConnection = Depends(get_db)):
+@app.get("/genres/", response_model=List[schemas.Genre], dependencies=[admit_read, deadline_lookup])
+def read_genres(skip: int = 0, limit: int = 100, conn: RealDictConnection = Depends(get_read_db)):
     genres = crud.get_genres(conn, skip=skip, limit=limit)
     return genres
 
-@app.get("/films/{film_id}", response_model=schemas.Film)
-def read_film(film_id: int, conn: RealDictConnection = Depends(get_db)):
-    film = crud.get_film(conn, film_id)
+@app.get("/films/{film_id}", response_model=schemas.FilmPartial, response_model_exclude_unset=True,
+         dependencies=[admit_read, deadline_lookup])
+def read_film(
+    film_id: int,
+    request: Request,
+    response: Response,
+    fields: Optional[tuple] = film_fields,
+    max_staleness: Optional[float] = Query(None, ge=0),
+    conn: RealDictConnection = Depends(get_read_db)
+):
+    film = None
+    snapshot_age = snapshot.age_for(request, conn, max_staleness)
+    if snapshot_age is not None:
+        film = crud.get_snapshot_film(conn, film_id, fields=fields)
+        if film is not None:
+            response.headers["X-Snapshot-Age"] = f"{snapshot_age:.1f}"
+    if film is None:
+        # Films added since the last refresh are not in the snapshot yet
+        film = crud.get_film(conn, film_id, fields=fields)
     if film is None:
         raise HTTPException(status_code=404, detail="Film not found")
     return film
 
-@app.post("/films/{film_id}/update", response_model=schemas.Film)
+@app.post("/films/{film_id}/update", response_model=schemas.Film, dependencies=[admit_write])
 def update_film(
     film_id: int,
     film: schemas.FilmUpdate,
@@ -152,29 +419,47 @@ def update_film(
         raise HTTPException(status_code=404, detail="Film not found")
     return updated_film
 
-@app.delete("/films/{film_id}", status_code=status.HTTP_204_NO_CONTENT)
+@app.delete("/films/{film_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[admit_write])
 def delete_film(film_id: int, conn: RealDictConnection = Depends(get_db), current_user: dict = Depends(check_filmadmin)):
     if not crud.delete_film(conn, film_id):
         raise HTTPException(status_code=404, detail="Film not found")
 
-@app.post("/genres/{genre_id}/update", response_model=schemas.Genre)
+@app.post("/genres/{genre_id}/update", response_model=schemas.Genre, dependencies=[admit_write])
 def update_genre(genre_id: int, genre: schemas.GenreCreate, conn: RealDictConnection = Depends(get_db), current_user: dict = Depends(check_filmadmin)):
     updated_genre = crud.update_genre(conn, genre_id, genre.dict())
     if updated_genre is None:
         raise HTTPException(status_code=404, detail="Genre not found")
     return updated_genre
 
-@app.delete("/genres/{genre_id}", status_code=status.HTTP_204_NO_CONTENT)
+@app.delete("/genres/{genre_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[admit_write])
 def delete_genre(genre_id: int, conn: RealDictConnection = Depends(get_db), current_user: dict = Depends(check_filmadmin)):
     if not crud.delete_genre(conn, genre_id):
         raise HTTPException(status_code=404, detail="Genre not found")
 
-@app.get("/films/{film_id}/reviews", response_model=List[schemas.ReviewWithFilmAndUser])
-def read_film_reviews(film_id: int, skip: int = 0, limit: int = 100, conn: RealDictConnection = Depends(get_db)):
-    reviews = crud.get_film_reviews(conn, film_id, skip=skip, limit=limit)
+@app.get("/films/{film_id}/reviews", response_model=List[schemas.ReviewPartial], response_model_exclude_unset=True,
+         dependencies=[admit_aggregate, deadline_listing])
+def read_film_reviews(film_id: int, skip: int = 0, limit: int = 100, fields: Optional[tuple] = review_fields,
+                      conn: RealDictConnection = Depends(get_read_db)):
+    reviews = crud.get_film_reviews(conn, film_id, skip=skip, limit=limit, fields=fields)
     return reviews
 
-@app.post("/films/{film_id}/reviews", response_model=schemas.ReviewWithFilmAndUser)
+def film_exists(film_id: int) -> bool:
+    with primary() as conn:
+        return crud.get_film(conn, film_id, fields=('id',)) is not None
+
+@app.get("/films/{film_id}/events")
+async def film_events(film_id: int, request: Request):
+    # Streams stay open for minutes, so instead of holding an admission slot they
+    # are only rate limited and capped by the hub. One listener connection feeds them all.
+    admission.READ.check_rate(rate_limit_key(request))
+    if events.at_capacity():
+        raise HTTPException(status_code=503, detail="Too many event streams, retry later", headers={"Retry-After": "5"})
+    if not await run_in_threadpool(film_exists, film_id):
+        raise HTTPException(status_code=404, detail="Film not found")
+    return StreamingResponse(events.stream(film_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/films/{film_id}/reviews", response_model=schemas.ReviewWithFilmAndUser, dependencies=[admit_write])
 def create_or_update_review(
     film_id: int,
     review: schemas.ReviewCreate,
@@ -183,7 +468,7 @@ def create_or_update_review(
 ):
     return crud.create_or_update_review(conn, review.dict(), film_id, current_user["id"])
 
-@app.post("/reviews/{review_id}/update", response_model=schemas.ReviewWithFilmAndUser)
+@app.post("/reviews/{review_id}/update", response_model=schemas.ReviewWithFilmAndUser, dependencies=[admit_write])
 def update_review(
     review_id: int,
     review: schemas.ReviewUpdate,
@@ -195,9 +480,9 @@ def update_review(
         raise HTTPException(status_code=404, detail="Review not found")
     if db_review['userid'] != current_user['id'] and current_user['role'] != 'filmadmin':
         raise HTTPException(status_code=403, detail="Not authorized to update this review")
-    return crud.update_review(conn, review_id, review.dict())
+    return crud.update_review(conn, review_id, db_review['filmid'], review.dict())
 
-@app.delete("/reviews/{review_id}", response_model=schemas.ReviewWithFilmAndUser)
+@app.delete("/reviews/{review_id}", response_model=schemas.ReviewWithFilmAndUser, dependencies=[admit_write])
 def delete_review(
     review_id: int, 
     conn: RealDictConnection = Depends(get_db), 
@@ -208,11 +493,63 @@ def delete_review(
         raise HTTPException(status_code=404, detail="Review not found")
     if db_review['userid'] != current_user['id'] and current_user['role'] != FILMADMIN:
         raise HTTPException(status_code=403, detail="Not authorized to delete this review")
-    deleted_review = crud.delete_review(conn, review_id)
+    deleted_review = crud.delete_review(conn, review_id, db_review['filmid'])
     if deleted_review is None:
         raise HTTPException(status_code=404, detail="Review not found")
     return deleted_review
 
+@app.exception_handler(singleflight.Timeout)
+def shared_query_timeout(request: Request, exc: singleflight.Timeout):
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": str(exc)})
+
+@app.exception_handler(QueryCanceled)
+def query_cancelled(request: Request, exc: QueryCanceled):
+    deadlines.record_cancellation(request)
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": "Query took too long and was cancelled"})
+
+@app.get("/admin/profiles", dependencies=[admit_read])
+def list_profiles(current_user: dict = Depends(check_filmadmin)):
+    return profiling.summaries()
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[admit_read])
+def read_profile(profile_id: int, format: str = Query("json", pattern="^(json|collapsed)$"),
+                 current_user: dict = Depends(check_filmadmin)):
+    profile = profiling.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        # Ready for flamegraph.pl or speedscope
+        return PlainTextResponse(profile.collapsed(),
+                                 headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.txt"'})
+    return profile.to_dict()
+
+# Both are async so they answer even while the threadpool is saturated
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    if not warmup.is_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {
+        **warmup.state(),
+        "pool": pool_state(),
+        "listener_connected": listener.is_connected(),
+        "caches": {
+            "autocomplete_loaded": autocomplete.index.loaded_at is not None,
+            "principals": len(principal_cache),
+            "facets": len(facet_cache),
+            "responses": len(compression.response_cache)
+        }
+    }
+
+@app.get("/metrics")
+def read_metrics():
+    return metrics.snapshot()
+
+app.add_middleware(compression.CompressionMiddleware, cache_enabled=listener.is_connected)
+app.add_middleware(profiling.ProfilingMiddleware, admin_role=FILMADMIN, resolve_user=profile_owner)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
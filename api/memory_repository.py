@@ -0,0 +1,322 @@
+import itertools
+from collections import Counter, defaultdict
+from psycopg2 import errors
+import crud
+from repository import Repository
+
+USER_COLUMNS = ('id', 'email', 'name', 'gender', 'dateofbirth', 'role')
+FILM_COLUMNS = ('id', 'filmname', 'description', 'year')
+
+def _page(rows, skip: int = 0, limit: int = None):
+    return rows[skip:] if limit is None else rows[skip:skip + limit]
+
+class MemoryRepository(Repository):
+    """Dict-backed Repository with the semantics of the Postgres schema, for tests and benchmarks.
+
+    Rows are kept in dicts keyed by id, in id order, with secondary indexes
+    for every lookup the routes make: email, genre name, film -> genres,
+    film -> reviews and user -> reviews. Aggregates are computed on read like
+    the correlated subqueries in crud, while film.average_rating is only
+    refreshed on review insert and update, as the V0002 trigger does.
+    Constraint violations raise the same psycopg2 errors as the database.
+    It is meant for one test or benchmark at a time and is not thread-safe
+    for concurrent writes.
+    """
+
+    def __init__(self):
+        self._ids = defaultdict(lambda: itertools.count(1))
+        self.users = {}
+        self.users_by_email = {}
+        self.films = {}
+        self.genres = {}
+        self.genres_by_name = {}
+        self.film_genres = defaultdict(set)  # film id -> genre ids
+        self.reviews = {}
+        self.reviews_by_film = defaultdict(dict)  # film id -> {review id: review}
+        self.reviews_by_user = defaultdict(dict)  # user id -> {review id: review}
+
+    def _next_id(self, table: str) -> int:
+        return next(self._ids[table])
+
+    def _rating(self, film_id: int):
+        reviews = self.reviews_by_film.get(film_id)
+        if not reviews:
+            return 0
+        return sum(review['tengrade'] for review in reviews.values()) / len(reviews)
+
+    def _genre_names(self, film_id: int):
+        return sorted(self.genres[genre_id]['genrename'] for genre_id in self.film_genres.get(film_id, ()))
+
+    def _film_card(self, film_id: int, columns=crud.FILM_FIELDS):
+        film = self.films[film_id]
+        computed = {
+            'genres': lambda: self._genre_names(film_id),
+            'average_rating': lambda: round(self._rating(film_id), 2)
+        }
+        return {name: computed[name]() if name in computed else film[name] for name in columns}
+
+    def _user_in_review(self, user_id: int, columns=crud.USER_IN_REVIEW_FIELDS):
+        user = self.users[user_id]
+        return {name: user[name] for name in columns}
+
+    def _review_rows(self, reviews, fields=None):
+        review_columns, film_columns, user_columns = crud._review_selection(fields)
+        rows = []
+        for review in reviews:
+            row = {name: review[name] for name in review_columns}
+            if film_columns is not None:
+                row['film'] = self._film_card(review['filmid'], film_columns)
+            if user_columns is not None:
+                row['user'] = self._user_in_review(review['userid'], user_columns)
+            rows.append(row)
+        return rows
+
+    def _require(self, table: dict, key, constraint: str):
+        if key not in table:
+            raise errors.ForeignKeyViolation(f'violates foreign key constraint "{constraint}"')
+
+    def _sync_genres(self, film_id: int, genre_names):
+        # Same outcome as sync_film_genres: missing genres are created, links match the list exactly
+        genre_ids = set()
+        for name in dict.fromkeys(name for name in genre_names if name is not None):
+            genre = self.genres_by_name.get(name) or self._insert_genre(name)
+            genre_ids.add(genre['id'])
+        self.film_genres[film_id] = genre_ids
+
+    def _insert_genre(self, name: str):
+        if name in self.genres_by_name:
+            raise errors.UniqueViolation('duplicate key value violates unique constraint "genre_genrename_key"')
+        genre = {'id': self._next_id('genre'), 'genrename': name}
+        self.genres[genre['id']] = self.genres_by_name[name] = genre
+        return genre
+
+    def _search_flags(self, film, name, genre, year, decade):
+        name_ok = not name or name.casefold() in film['filmname'].casefold()
+        genre_row = self.genres_by_name.get(genre) if genre else None
+        genre_ok = not genre or (genre_row is not None and genre_row['id'] in self.film_genres.get(film['id'], ()))
+        year_ok = (not year or film['year'] == year) and (decade is None or decade <= film['year'] < decade + 10)
+        return name_ok, genre_ok, year_ok
+
+    def get_user_by_email(self, email: str):
+        user = self.users_by_email.get(email)
+        return dict(user) if user else None
+
+    def create_user(self, user):
+        crud.check_registration_age(user)
+        if user.email in self.users_by_email:
+            raise errors.UniqueViolation('duplicate key value violates unique constraint "filmuser_email_key"')
+        row = {
+            'id': self._next_id('filmuser'),
+            'email': user.email,
+            'name': user.name,
+            'gender': user.gender,
+            'dateofbirth': user.dateofbirth,
+            'hashedpassword': crud.pwd_context.hash(user.password),
+            'role': 'user'
+        }
+        self.users[row['id']] = self.users_by_email[row['email']] = row
+        return {name: row[name] for name in USER_COLUMNS}
+
+    def get_users(self, skip: int = 0, limit: int = 100):
+        return [{name: user[name] for name in USER_COLUMNS} for user in _page(list(self.users.values()), skip, limit)]
+
+    def get_user_role(self, user_id: int):
+        user = self.users.get(user_id)
+        return user['role'] if user else None
+
+    def create_film(self, film):
+        row = {
+            'id': self._next_id('film'),
+            'filmname': film.filmname,
+            'description': film.description,
+            'year': film.year,
+            'average_rating': 0
+        }
+        self.films[row['id']] = row
+        self._sync_genres(row['id'], film.genres or [])
+        return {**row, 'genres': self._genre_names(row['id'])}
+
+    def get_films(self, skip: int = 0, limit: int = 100, fields: tuple = None):
+        columns = crud._pick(crud.FILM_FIELDS, fields)
+        films = [self._film_card(film_id, columns) for film_id in _page(list(self.films), skip, limit)]
+        return films, len(self.films)
+
+    def get_film(self, film_id: int, fields: tuple = None):
+        if film_id not in self.films:
+            return None
+        return self._film_card(film_id, crud._pick(crud.FILM_FIELDS, fields))
+
+    # There is nothing to materialize in memory, the snapshot is always current
+    def get_snapshot_age(self):
+        return 0.0
+
+    def get_snapshot_films(self, skip: int = 0, limit: int = 100, fields: tuple = None):
+        return self.get_films(skip, limit, fields)
+
+    def get_snapshot_film(self, film_id: int, fields: tuple = None):
+        return self.get_film(film_id, fields)
+
+    def update_film(self, film_id: int, film_data: dict):
+        updates = {name: film_data[name] for name in FILM_COLUMNS if name in film_data}
+        if film_id not in self.films:
+            return None
+        if any(updates.get(name, '') is None for name in ('filmname', 'year')):
+            raise errors.NotNullViolation('null value in column violates not-null constraint')
+        self.films[film_id].update(updates)
+        if 'genres' in film_data:
+            self._sync_genres(film_id, film_data['genres'] or [])
+        return self._film_card(film_id)
+
+    def delete_film(self, film_id: int):
+        if film_id not in self.films:
+            return False
+        if self.reviews_by_film.get(film_id):
+            raise errors.ForeignKeyViolation('update or delete on table "film" violates foreign key constraint "fk_film"')
+        self.film_genres.pop(film_id, None)
+        self.reviews_by_film.pop(film_id, None)
+        del self.films[film_id]
+        return True
+
+    def search_films(self, name: str = None, genre: str = None, year: int = None, decade: int = None,
+                     skip: int = 0, limit: int = None, fields: tuple = None):
+        columns = crud._pick(crud.FILM_FIELDS, fields)
+        matches = [film['id'] for film in self.films.values() if all(self._search_flags(film, name, genre, year, decade))]
+        return [self._film_card(film_id, columns) for film_id in _page(matches, skip, limit)]
+
+    def search_facets(self, name: str = None, genre: str = None, year: int = None, decade: int = None):
+        genre_counts, decade_counts, total = Counter(), Counter(), 0
+        for film in self.films.values():
+            name_ok, genre_ok, year_ok = self._search_flags(film, name, genre, year, decade)
+            if not name_ok:
+                continue
+            if year_ok:
+                genre_counts.update(self._genre_names(film['id']))
+            if genre_ok:
+                decade_counts[film['year'] // 10 * 10] += 1
+            total += genre_ok and year_ok
+        return {
+            'total': total,
+            'genres': [{'genre': genre_name, 'count': count}
+                       for genre_name, count in sorted(genre_counts.items(), key=lambda item: (-item[1], item[0]))],
+            'decades': [{'decade': film_decade, 'count': count} for film_decade, count in sorted(decade_counts.items())]
+        }
+
+    def get_title_popularity(self, film_ids: list = None):
+        film_ids = list(film_ids) if film_ids is not None else list(self.films)
+        return [{
+            'id': self.films[id_]['id'],
+            'filmname': self.films[id_]['filmname'],
+            'year': self.films[id_]['year'],
+            'review_count': len(self.reviews_by_film.get(id_, ())),
+            'average_rating': self._rating(id_)
+        } for id_ in film_ids if id_ in self.films]
+
+    def create_or_update_review(self, review_data, film_id: int, user_id: int):
+        self._require(self.films, film_id, "fk_film")
+        self._require(self.users, user_id, "fk_user")
+        values = {
+            'reviewtext': review_data['reviewtext'],
+            'tengrade': max(1, min(review_data['tengrade'], 10)),
+            'binarygrade': review_data['binarygrade']
+        }
+        review = next((review for review in self.reviews_by_user.get(user_id, {}).values()
+                       if review['filmid'] == film_id), None)
+        if review is not None:
+            review.update(values)
+        else:
+            review = {'id': self._next_id('review'), **values, 'filmid': film_id, 'userid': user_id}
+            self.reviews[review['id']] = review
+            self.reviews_by_film[film_id][review['id']] = review
+            self.reviews_by_user[user_id][review['id']] = review
+        self.films[film_id]['average_rating'] = round(self._rating(film_id), 2)
+
+        film = self.films[film_id]
+        return {
+            **values,
+            'id': review['id'],
+            'film': {**{name: film[name] for name in FILM_COLUMNS},
+                     'genres': self._genre_names(film_id),
+                     'average_rating': float(film['average_rating'])},
+            'user': self._user_in_review(user_id)
+        }
+
+    def get_film_reviews(self, film_id: int, skip: int = 0, limit: int = 100, fields: tuple = None):
+        _, film_columns, _ = crud._review_selection(fields)
+        if film_columns is not None and film_id not in self.films:
+            return []
+        return self._review_rows(_page(list(self.reviews_by_film.get(film_id, {}).values()), skip, limit), fields)
+
+    def get_reviews(self, skip: int = 0, limit: int = 100, fields: tuple = None):
+        return self._review_rows(_page(list(self.reviews.values()), skip, limit), fields)
+
+    def get_user_reviews(self, user_id: int, before: int = None, limit: int = 20):
+        reviews = [review for review in reversed(self.reviews_by_user.get(user_id, {}).values())
+                   if before is None or review['id'] < before]
+        rows = []
+        for review in reviews[:limit]:
+            row = {name: review[name] for name in crud.REVIEW_FIELDS}
+            row['film'] = self._film_card(review['filmid'], ('id', 'filmname', 'year', 'average_rating'))
+            rows.append(row)
+        return rows
+
+    def get_review(self, review_id: int):
+        review = self.reviews.get(review_id)
+        return dict(review) if review else None
+
+    def update_review(self, review_id: int, film_id: int, review_data: dict):
+        review = self.reviews_by_film.get(film_id, {}).get(review_id)
+        if review is None:
+            return None
+        if not 1 <= review_data['tengrade'] <= 10:
+            raise errors.CheckViolation('new row for relation "review" violates check constraint "review_tengrade_check"')
+        review.update({name: review_data[name] for name in ('reviewtext', 'tengrade', 'binarygrade')})
+        self.films[film_id]['average_rating'] = round(self._rating(film_id), 2)
+        return self._review_rows([review])[0]
+
+    def delete_review(self, review_id: int, film_id: int):
+        review = self.reviews_by_film.get(film_id, {}).get(review_id)
+        if review is None:
+            return None
+        deleted = self._review_rows([review])[0]
+        del self.reviews[review_id]
+        del self.reviews_by_film[film_id][review_id]
+        del self.reviews_by_user[review['userid']][review_id]
+        # Unlike the stored film.average_rating, the returned rating already leaves the review out
+        deleted['film']['average_rating'] = round(self._rating(film_id), 2)
+        return deleted
+
+    def create_genre(self, genre):
+        return dict(self._insert_genre(genre.genrename))
+
+    def get_genres(self, skip: int = 0, limit: int = 100):
+        return [dict(genre) for genre in _page(list(self.genres.values()), skip, limit)]
+
+    def add_film_genre(self, film_id: int, genre_id: int):
+        self._require(self.films, film_id, "fk_film")
+        self._require(self.genres, genre_id, "fk_genre")
+        if genre_id in self.film_genres[film_id]:
+            raise errors.UniqueViolation('duplicate key value violates unique constraint "film_genre_pkey"')
+        self.film_genres[film_id].add(genre_id)
+        return {'filmid': film_id, 'genreid': genre_id}
+
+    def update_genre(self, genre_id: int, genre_data: dict):
+        genre = self.genres.get(genre_id)
+        if genre is None:
+            return None
+        name = genre_data['genrename']
+        if name != genre['genrename']:
+            if name in self.genres_by_name:
+                raise errors.UniqueViolation('duplicate key value violates unique constraint "genre_genrename_key"')
+            del self.genres_by_name[genre['genrename']]
+            genre['genrename'] = name
+            self.genres_by_name[name] = genre
+        return dict(genre)
+
+    def delete_genre(self, genre_id: int):
+        genre = self.genres.pop(genre_id, None)
+        if genre is None:
+            return False
+        del self.genres_by_name[genre['genrename']]
+        for genre_ids in self.film_genres.values():
+            genre_ids.discard(genre_id)
+        return True
@@ -0,0 +1,21 @@
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(int)
+_gauges = {}
+_lock = threading.Lock()
+
+def incr(name: str, value: int = 1):
+    with _lock:
+        _counters[name] += value
+
+def gauge(name: str, fn):
+    """Register a callable that reports the current value of `name` when metrics are read."""
+    _gauges[name] = fn
+
+def snapshot():
+    with _lock:
+        data = dict(_counters)
+    for name, fn in _gauges.items():
+        data[name] = fn()
+    return dict(sorted(data.items()))
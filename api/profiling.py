@@ -0,0 +1,305 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from psycopg2.extras import RealDictCursor
+import metrics
+
+# Fraction of all requests profiled without being asked, 0 turns sampling off
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+MAX_STACK_DEPTH = 64
+MAX_QUERIES = 100
+HEADER = b"x-profile"
+
+_current = contextvars.ContextVar("profile", default=None)
+_ids = itertools.count(1)
+_profiles = deque(maxlen=KEEP)
+_active = set()
+_active_changed = threading.Condition()
+_sampler = None
+
+class Profile:
+    """Phase timings, DB queries and stack samples of one request.
+
+    Phases may overlap: auth includes the queries it makes, endpoint includes
+    db. dependencies is the time from the route handler starting to the
+    endpoint being called, serialization the time from the endpoint returning
+    to the response being ready.
+    """
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = next(_ids)
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = datetime.now(timezone.utc)
+        self.status = None
+        self.user = None
+        self.phases = Counter()
+        self.queries = []
+        self.query_count = 0
+        self.samples = Counter()
+        self.endpoint_span = [None, None]
+        self._threads = Counter()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def add_query(self, query, seconds: float):
+        with self._lock:
+            self.query_count += 1
+            if len(self.queries) < MAX_QUERIES:
+                text = query.decode(errors="replace") if isinstance(query, bytes) else str(query)
+                self.queries.append({'sql': " ".join(text.split())[:300], 'ms': round(seconds * 1000, 3)})
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        # Work done inside a phase is what the sampler looks at, so the thread is watched meanwhile
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def sample(self, frames):
+        with self._lock:
+            idents = list(self._threads)
+        for ident in idents:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def finish(self):
+        self.phases['total'] = time.perf_counter() - self._started
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'trigger': self.trigger,
+            'started_at': self.started_at.isoformat(),
+            'total_ms': round(self.phases['total'] * 1000, 3)
+        }
+
+    def to_dict(self):
+        return {
+            **self.summary(),
+            'user_id': self.user['id'] if self.user else None,
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in sorted(self.phases.items())},
+            'db_queries': self.query_count,
+            'queries': self.queries,
+            'samples': sum(self.samples.values()),
+            'sample_interval_ms': SAMPLE_INTERVAL * 1000,
+            'stacks': dict(self.samples.most_common(50))
+        }
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+def current():
+    return _current.get()
+
+_NO_PHASE = contextlib.nullcontext()
+
+def phase(name: str):
+    profile = _current.get()
+    return _NO_PHASE if profile is None else profile.phase(name)
+
+def timed(name: str):
+    """Decorate a sync function, a FastAPI dependency for instance, to count its time as a phase."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            with profile.phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def note_user(user):
+    profile = _current.get()
+    if profile is not None:
+        profile.user = user
+
+class TimedCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        profile = _current.get()
+        if profile is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            with profile.phase("db"):
+                return super().execute(query, vars)
+        finally:
+            profile.add_query(query, time.perf_counter() - started)
+
+def instrument(conn):
+    """Time the statements of a fresh connection when the current request is profiled."""
+    if _current.get() is not None and hasattr(conn, "cursor_factory"):
+        conn.cursor_factory = TimedCursor
+
+def _timed_endpoint(endpoint):
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            profile.endpoint_span[0] = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.endpoint_span[1] = time.perf_counter()
+    else:
+        @functools.wraps(endpoint)
+        def timed_endpoint(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return endpoint(*args, **kwargs)
+            profile.endpoint_span[0] = time.perf_counter()
+            try:
+                with profile.phase("endpoint"):
+                    return endpoint(*args, **kwargs)
+            finally:
+                profile.endpoint_span[1] = time.perf_counter()
+    return timed_endpoint
+
+class ProfiledRoute(APIRoute):
+    """APIRoute that splits a profiled request into dependencies, endpoint and serialization."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            profile = _current.get()
+            if profile is None:
+                return await handler(request)
+            started = time.perf_counter()
+            response = await handler(request)
+            finished = time.perf_counter()
+            endpoint_started, endpoint_finished = profile.endpoint_span
+            if endpoint_started is not None and endpoint_finished is not None:
+                profile.add("dependencies", endpoint_started - started)
+                profile.add("serialization", finished - endpoint_finished)
+                profile.phases.setdefault("endpoint", endpoint_finished - endpoint_started)
+            return response
+        return profiled_handler
+
+def _sample_forever():
+    while True:
+        with _active_changed:
+            while not _active:
+                _active_changed.wait()
+            profiles = list(_active)
+        frames = sys._current_frames()
+        for profile in profiles:
+            profile.sample(frames)
+        del frames
+        time.sleep(SAMPLE_INTERVAL)
+
+def _start(profile: Profile):
+    global _sampler
+    with _active_changed:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_forever, name="profile-sampler", daemon=True)
+            _sampler.start()
+        _active.add(profile)
+        _active_changed.notify()
+
+def _stop(profile: Profile):
+    with _active_changed:
+        _active.discard(profile)
+
+def get(profile_id: int):
+    return next((profile for profile in _profiles if profile.id == profile_id), None)
+
+def summaries():
+    return [profile.summary() for profile in reversed(_profiles)]
+
+class ProfilingMiddleware:
+    """Profile requests that carry an X-Profile header or fall in the PROFILE_SAMPLE_RATE sample.
+
+    The header is honoured for filmadmins only: `resolve_user` maps the
+    Authorization header to a user, or None, before anything is recorded, so
+    nobody else can make the server sample stacks and time queries. Requests
+    without the header cost a header lookup and, with sampling on, one random
+    number.
+    """
+
+    def __init__(self, app, admin_role: str, resolve_user):
+        self.app = app
+        self.admin_role = admin_role
+        self.resolve_user = resolve_user
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        user = None
+        requested = HEADER in headers and b"authorization" in headers
+        if requested:
+            user = await run_in_threadpool(self.resolve_user, headers[b"authorization"].decode("latin-1"))
+            requested = user is not None and user.get('role') == self.admin_role
+            if not requested:
+                metrics.incr("profiles.refused")
+        sampled = SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+        if not (requested or sampled):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], "header" if requested else "sample")
+        profile.user = user
+        token = _current.set(profile)
+
+        async def profiled_send(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                if requested:
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", str(profile.id).encode())]}
+            await send(message)
+
+        _start(profile)
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            _stop(profile)
+            _current.reset(token)
+            profile.finish()
+            _profiles.append(profile)
+            metrics.incr(f"profiles.{profile.trigger}")
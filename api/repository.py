@@ -0,0 +1,108 @@
+import functools
+from abc import ABC, abstractmethod
+
+class Repository(ABC):
+    """Storage behind the crud functions.
+
+    crud functions decorated with @dispatch accept a Repository in place of
+    the psycopg2 connection and then call the method of the same name with
+    the remaining arguments. crud itself is the Postgres implementation,
+    memory_repository.MemoryRepository keeps everything in process.
+    """
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def get_user_by_email(self, email: str): ...
+
+    @abstractmethod
+    def create_user(self, user): ...
+
+    @abstractmethod
+    def get_users(self, skip: int = 0, limit: int = 100): ...
+
+    @abstractmethod
+    def get_user_role(self, user_id: int): ...
+
+    @abstractmethod
+    def create_film(self, film): ...
+
+    @abstractmethod
+    def get_films(self, skip: int = 0, limit: int = 100, fields: tuple = None): ...
+
+    @abstractmethod
+    def get_film(self, film_id: int, fields: tuple = None): ...
+
+    @abstractmethod
+    def update_film(self, film_id: int, film_data: dict): ...
+
+    @abstractmethod
+    def delete_film(self, film_id: int): ...
+
+    @abstractmethod
+    def get_snapshot_age(self): ...
+
+    @abstractmethod
+    def get_snapshot_films(self, skip: int = 0, limit: int = 100, fields: tuple = None): ...
+
+    @abstractmethod
+    def get_snapshot_film(self, film_id: int, fields: tuple = None): ...
+
+    @abstractmethod
+    def search_films(self, name: str = None, genre: str = None, year: int = None, decade: int = None,
+                     skip: int = 0, limit: int = None, fields: tuple = None): ...
+
+    @abstractmethod
+    def search_facets(self, name: str = None, genre: str = None, year: int = None, decade: int = None): ...
+
+    @abstractmethod
+    def get_title_popularity(self, film_ids: list = None): ...
+
+    @abstractmethod
+    def create_or_update_review(self, review_data, film_id: int, user_id: int): ...
+
+    @abstractmethod
+    def get_film_reviews(self, film_id: int, skip: int = 0, limit: int = 100, fields: tuple = None): ...
+
+    @abstractmethod
+    def get_reviews(self, skip: int = 0, limit: int = 100, fields: tuple = None): ...
+
+    @abstractmethod
+    def get_user_reviews(self, user_id: int, before: int = None, limit: int = 20): ...
+
+    @abstractmethod
+    def get_review(self, review_id: int): ...
+
+    @abstractmethod
+    def update_review(self, review_id: int, film_id: int, review_data: dict): ...
+
+    @abstractmethod
+    def delete_review(self, review_id: int, film_id: int): ...
+
+    @abstractmethod
+    def create_genre(self, genre): ...
+
+    @abstractmethod
+    def get_genres(self, skip: int = 0, limit: int = 100): ...
+
+    @abstractmethod
+    def add_film_genre(self, film_id: int, genre_id: int): ...
+
+    @abstractmethod
+    def update_genre(self, genre_id: int, genre_data: dict): ...
+
+    @abstractmethod
+    def delete_genre(self, genre_id: int): ...
+
+def dispatch(fn):
+    """Route a crud function to the same-named Repository method when it is given a Repository."""
+    if not hasattr(Repository, fn.__name__):
+        raise TypeError(f"Repository has no method {fn.__name__}")
+
+    @functools.wraps(fn)
+    def wrapper(conn, *args, **kwargs):
+        if isinstance(conn, Repository):
+            return getattr(conn, fn.__name__)(*args, **kwargs)
+        return fn(conn, *args, **kwargs)
+    return wrapper
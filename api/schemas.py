@@ -29,7 +29,7 @@ class FilmCreate(FilmBase):
 class Film(BaseModel):
     id: int
     filmname: str
-    description: str
+    description: Optional[str] = None
     year: int
     genres: List[str]
     average_rating: float
@@ -37,6 +37,28 @@ class Film(BaseModel):
     class Config:
         from_attributes = True
 
+class FilmSuggestion(BaseModel):
+    id: int
+    filmname: str
+    year: int
+
+class GenreFacet(BaseModel):
+    genre: str
+    count: int
+
+class DecadeFacet(BaseModel):
+    decade: int
+    count: int
+
+class SearchFacets(BaseModel):
+    genres: List[GenreFacet]
+    decades: List[DecadeFacet]
+
+class FacetedSearchResult(BaseModel):
+    results: List[Film]
+    total: int
+    facets: SearchFacets
+
 class ReviewBase(BaseModel):
     reviewtext: str
     tengrade: int
@@ -79,11 +101,24 @@ class FilmUpdate(BaseModel):
 class FilmInReview(BaseModel):
     id: int
     filmname: str
-    description: str
+    description: Optional[str] = None
     year: int
     genres: List[str]
     average_rating: float
 
+class FilmSummary(BaseModel):
+    id: int
+    filmname: str
+    year: int
+    average_rating: float
+
+class UserReview(BaseModel):
+    id: int
+    reviewtext: str
+    tengrade: int
+    binarygrade: bool
+    film: FilmSummary
+
 class UserInReview(BaseModel):
     id: int
     name: str
@@ -97,3 +132,27 @@ class ReviewWithFilmAndUser(BaseModel):
     binarygrade: bool
     film: FilmInReview
     user: UserInReview
+
+# Shapes for ?fields= responses. Routes using them set response_model_exclude_unset,
+# so fields that were not selected are left out instead of being sent as null.
+class FilmPartial(BaseModel):
+    id: int
+    filmname: Optional[str] = None
+    description: Optional[str] = None
+    year: Optional[int] = None
+    genres: Optional[List[str]] = None
+    average_rating: Optional[float] = None
+
+class UserInReviewPartial(BaseModel):
+    id: int
+    name: Optional[str] = None
+    email: Optional[str] = None
+    role: Optional[str] = None
+
+class ReviewPartial(BaseModel):
+    id: int
+    reviewtext: Optional[str] = None
+    tengrade: Optional[int] = None
+    binarygrade: Optional[bool] = None
+    film: Optional[FilmPartial] = None
+    user: Optional[UserInReviewPartial] = None
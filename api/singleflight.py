@@ -0,0 +1,84 @@
+import functools
+import os
+import threading
+import metrics
+from deadlines import client_disconnected
+
+# How long a request waits for an identical query started by another request
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "10"))
+
+class Timeout(Exception):
+    pass
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+_calls = {}
+_lock = threading.Lock()
+
+def do(key, fn, timeout: float = SINGLEFLIGHT_TIMEOUT):
+    """Run fn once for all concurrent callers with the same key and share its result.
+
+    The first caller executes fn, later callers block until it finishes and
+    get the same result object (which must therefore not be mutated) or the
+    same exception.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if leader:
+        metrics.incr("singleflight.executed")
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            # The leader's query is cancelled when its own client leaves, which says
+            # nothing about the query itself, so waiters should run it again
+            call.abandoned = client_disconnected()
+            raise
+        finally:
+            with _lock:
+                if _calls.get(key) is call:
+                    del _calls[key]
+            call.done.set()
+
+    if not call.done.wait(timeout):
+        metrics.incr("singleflight.timeouts")
+        raise Timeout(f"Timed out waiting for shared query {key[0]}")
+    if call.abandoned:
+        metrics.incr("singleflight.retried")
+        return do(key, fn, timeout)
+    metrics.incr("singleflight.saved")
+    if call.error is not None:
+        raise call.error
+    return call.result
+
+def forget_all():
+    """Stop new callers from joining queries that are already running.
+
+    Called when data changes, so a request that starts after a write never
+    receives a result read before it.
+    """
+    with _lock:
+        _calls.clear()
+
+def coalesce(fn):
+    """Share the result of concurrent identical calls of a crud read function on the same server.
+
+    Calls on different connections to one server share a result, calls on the
+    primary and on a replica don't: a primary read must not be answered by a
+    lagging replica, and server-specific reads like the snapshot age differ.
+    """
+    @functools.wraps(fn)
+    def wrapper(conn, *args, **kwargs):
+        key = (fn.__name__, getattr(conn, "dsn", None), args, tuple(sorted(kwargs.items())))
+        return do(key, lambda: fn(conn, *args, **kwargs))
+    return wrapper
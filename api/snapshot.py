@@ -0,0 +1,94 @@
+import os
+import threading
+from fastapi import Request
+from database import primary, DATABASE_URL
+import compression
+import crud
+import metrics
+
+# How stale a snapshot anonymous requests accept, unless they ask for less with ?max_staleness=
+MAX_STALENESS = float(os.getenv("SNAPSHOT_MAX_STALENESS", "60"))
+# film_card is refreshed this often, or sooner once this many changes have been heard
+REFRESH_SECONDS = float(os.getenv("SNAPSHOT_REFRESH_SECONDS", "30"))
+REFRESH_CHANGES = int(os.getenv("SNAPSHOT_REFRESH_CHANGES", "100"))
+# Cluster-wide floor between two refreshes, every worker hears the same changes. It grows to
+# this many times the duration of the last refresh, which rebuilds the view from every film.
+MIN_REFRESH_SECONDS = float(os.getenv("SNAPSHOT_MIN_REFRESH_SECONDS", "5"))
+REFRESH_COST_FACTOR = float(os.getenv("SNAPSHOT_REFRESH_COST_FACTOR", "10"))
+
+_changes = 0
+_changes_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_thread = None
+
+metrics.gauge("snapshot.pending_changes", lambda: _changes)
+
+def record_change():
+    global _changes
+    with _changes_lock:
+        _changes += 1
+        if _changes >= REFRESH_CHANGES:
+            _wake.set()
+
+def request_refresh():
+    _wake.set()
+
+def age_for(request: Request, conn, max_staleness: float = None):
+    """Snapshot age if this request may be served from film_card, None if it has to read live data.
+
+    Only anonymous requests use the snapshot, logged-in users expect to see
+    their own writes right away. A response served from it may be cached for
+    what is left of the bound, no longer.
+    """
+    if "authorization" in request.headers:
+        return None
+    bound = MAX_STALENESS if max_staleness is None else min(max_staleness, MAX_STALENESS)
+    if bound <= 0:
+        return None
+    age = crud.get_snapshot_age(conn)
+    if age > bound:
+        metrics.incr("snapshot.too_stale")
+        return None
+    metrics.incr("snapshot.served")
+    request.state.cache_ttl = bound - age
+    return age
+
+def _refresh():
+    global _changes
+    with _changes_lock:
+        _changes = 0
+    with primary() as conn:
+        if crud.refresh_snapshot(conn, MIN_REFRESH_SECONDS, REFRESH_COST_FACTOR):
+            metrics.incr("snapshot.refreshed")
+            compression.invalidate("snapshot")
+        else:
+            metrics.incr("snapshot.refresh_skipped")
+
+def _run():
+    while not _stop.is_set():
+        _wake.wait(REFRESH_SECONDS)
+        _wake.clear()
+        if _stop.is_set():
+            break
+        try:
+            _refresh()
+        except Exception as e:
+            print(f"Film card refresh failed: {e}")
+
+def start():
+    global _thread
+    if _thread is not None or not DATABASE_URL:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="snapshot-refresher", daemon=True)
+    _thread.start()
+
+def stop():
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _wake.set()
+    _thread.join(timeout=1)
+    _thread = None
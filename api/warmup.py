@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from database import DATABASE_URL, open_pool, every_pooled_connection, primary
+import autocomplete
+import crud
+import metrics
+
+# A failed warm-up is retried this often, the process reports unready meanwhile
+RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+# Leading pages of the film list read on every pooled connection
+FILM_PAGES = int(os.getenv("WARMUP_FILM_PAGES", "3"))
+PAGE_SIZE = 100
+
+_steps = []
+_timings = {}
+_error = None
+_ready = threading.Event()
+_stop = threading.Event()
+_thread = None
+
+def step(name: str):
+    """Register a function to run once before the process reports ready, in registration order."""
+    def decorator(fn):
+        _steps.append((name, fn))
+        return fn
+    return decorator
+
+@step("pool")
+def _open_pool():
+    open_pool()
+
+def _uncoalesced(fn):
+    # A shared query would run on some other request's connection instead of the one being warmed
+    return fn.__wrapped__
+
+@step("queries")
+def _run_hot_queries():
+    # Every pooled backend, primary and replicas, runs them, so none serves its first
+    # request with cold catalog caches, and the pages they read are in shared buffers
+    with every_pooled_connection() as connections:
+        for conn in connections:
+            _uncoalesced(crud.get_genres)(conn)
+            _uncoalesced(crud.get_snapshot_age)(conn)
+            for page in range(FILM_PAGES):
+                _uncoalesced(crud.get_films)(conn, skip=page * PAGE_SIZE, limit=PAGE_SIZE)
+                _uncoalesced(crud.get_snapshot_films)(conn, skip=page * PAGE_SIZE, limit=PAGE_SIZE)
+            conn.rollback()
+
+@step("autocomplete")
+def _load_autocomplete():
+    autocomplete.ensure_loaded(primary)
+
+@step("password_hasher")
+def _init_password_hasher():
+    # Loads the bcrypt backend, which otherwise happens on the first login
+    crud.pwd_context.dummy_verify()
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def state():
+    return {'ready': is_ready(), 'steps_ms': dict(_timings), 'error': _error}
+
+def _run():
+    global _error
+    started = time.perf_counter()
+    while not _stop.is_set():
+        for name, fn in _steps:
+            if name in _timings:
+                continue
+            step_started = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                _error = f"{name}: {str(e).strip()}"
+                metrics.incr("warmup.failures")
+                print(f"Warm-up step {name} failed, retrying in {RETRY_SECONDS}s: {e}")
+                break
+            _timings[name] = round((time.perf_counter() - step_started) * 1000, 1)
+        else:
+            _error = None
+            _ready.set()
+            print(f"Warm-up finished in {time.perf_counter() - started:.2f}s: {_timings}")
+            return
+        _stop.wait(RETRY_SECONDS)
+
+def start():
+    """Warm up in the background: the server answers /healthz meanwhile and /readyz once done."""
+    global _thread
+    if not DATABASE_URL:
+        _ready.set()
+        return
+    if _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="warm-up", daemon=True)
+    _thread.start()
+
+def stop():
+    global _thread
+    # Unready first, so traffic is drained away while the process shuts down
+    _ready.clear()
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join(timeout=1)
+    _thread = None
@@ -0,0 +1,70 @@
+-- Broadcast row changes so every API process can invalidate its local state.
+-- Only key columns are sent: NOTIFY payloads are limited to 8000 bytes and
+-- must not carry review texts or password hashes.
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    payload JSONB;
+    row_data JSONB;
+BEGIN
+    payload := jsonb_build_object('table', lower(TG_TABLE_NAME), 'op', TG_OP);
+
+    IF TG_LEVEL = 'ROW' THEN
+        IF TG_OP = 'DELETE' THEN
+            row_data := to_jsonb(OLD);
+        ELSE
+            row_data := to_jsonb(NEW);
+        END IF;
+
+        payload := payload || (
+            SELECT COALESCE(jsonb_object_agg(key, value), '{}'::jsonb)
+            FROM jsonb_each(row_data)
+            WHERE key IN ('id', 'filmid', 'genreid', 'userid', 'email')
+        );
+    END IF;
+
+    PERFORM pg_notify('filmdb_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER film_notify_change_trigger
+AFTER INSERT OR UPDATE OR DELETE ON FILM
+FOR EACH ROW EXECUTE FUNCTION notify_change();
+
+CREATE TRIGGER genre_notify_change_trigger
+AFTER INSERT OR UPDATE OR DELETE ON GENRE
+FOR EACH ROW EXECUTE FUNCTION notify_change();
+
+CREATE TRIGGER film_genre_notify_change_trigger
+AFTER INSERT OR UPDATE OR DELETE ON FILM_GENRE
+FOR EACH ROW EXECUTE FUNCTION notify_change();
+
+CREATE TRIGGER review_notify_change_trigger
+AFTER INSERT OR UPDATE OR DELETE ON REVIEW
+FOR EACH ROW EXECUTE FUNCTION notify_change();
+
+CREATE TRIGGER filmuser_notify_change_trigger
+AFTER INSERT OR UPDATE OR DELETE ON FILMUSER
+FOR EACH ROW EXECUTE FUNCTION notify_change();
+
+-- TRUNCATE has no rows to report, listeners treat it as a full flush
+CREATE TRIGGER film_notify_truncate_trigger
+AFTER TRUNCATE ON FILM
+FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+CREATE TRIGGER genre_notify_truncate_trigger
+AFTER TRUNCATE ON GENRE
+FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+CREATE TRIGGER film_genre_notify_truncate_trigger
+AFTER TRUNCATE ON FILM_GENRE
+FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+CREATE TRIGGER review_notify_truncate_trigger
+AFTER TRUNCATE ON REVIEW
+FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
+
+CREATE TRIGGER filmuser_notify_truncate_trigger
+AFTER TRUNCATE ON FILMUSER
+FOR EACH STATEMENT EXECUTE FUNCTION notify_change();
@@ -0,0 +1,66 @@
+-- Make the film's genre links match genre_names in a single statement:
+-- missing genres are upserted, only new links are inserted and only
+-- removed links are deleted.
+--
+-- Genres already visible to the statement are reused as is. The rest go
+-- through ON CONFLICT DO UPDATE rather than DO NOTHING: if another admin
+-- commits the same genre name concurrently, DO NOTHING would return no row
+-- (the new genre is not in our snapshot), while DO UPDATE waits for it and
+-- returns its id.
+CREATE OR REPLACE FUNCTION sync_film_genres(film_id INTEGER, genre_names TEXT[])
+RETURNS VOID AS $$
+BEGIN
+    WITH wanted AS (
+        SELECT DISTINCT name AS genrename
+        FROM unnest(genre_names) AS name
+        WHERE name IS NOT NULL
+    ),
+    existing AS (
+        SELECT g.ID AS genreid, g.GenreName
+        FROM GENRE g
+        JOIN wanted w ON w.genrename = g.GenreName
+    ),
+    created AS (
+        INSERT INTO GENRE (GenreName)
+        SELECT w.genrename
+        FROM wanted w
+        WHERE NOT EXISTS (SELECT 1 FROM existing e WHERE e.GenreName = w.genrename)
+        ON CONFLICT (GenreName) DO UPDATE SET GenreName = EXCLUDED.GenreName
+        RETURNING ID AS genreid
+    ),
+    resolved AS (
+        SELECT genreid FROM existing
+        UNION ALL
+        SELECT genreid FROM created
+    ),
+    removed AS (
+        DELETE FROM FILM_GENRE fg
+        WHERE fg.FilmID = film_id
+          AND fg.GenreID NOT IN (SELECT genreid FROM resolved)
+    )
+    INSERT INTO FILM_GENRE (FilmID, GenreID)
+    SELECT film_id, genreid FROM resolved
+    ON CONFLICT DO NOTHING;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create a stored procedure to add a new film with genres
+CREATE OR REPLACE PROCEDURE add_film_with_genres(
+    film_name TEXT,
+    film_year INTEGER,
+    film_description TEXT,
+    genre_names TEXT[]
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_film_id INTEGER;
+BEGIN
+    -- Insert the new film
+    INSERT INTO FILM (FilmName, Year, Description)
+    VALUES (film_name, film_year, film_description)
+    RETURNING ID INTO new_film_id;
+
+    PERFORM sync_film_genres(new_film_id, genre_names);
+END;
+$$;
@@ -0,0 +1,124 @@
+-- Hash-partitioned replacement for REVIEW.
+--
+-- Every unique constraint has to include the partition key, so the primary
+-- key becomes (FilmID, ID). IDs keep coming from review_id_seq and stay
+-- globally unique; the plain index on ID only serves lookups by review id,
+-- which probe one small index per partition.
+CREATE TABLE REVIEW_PARTITIONED (
+    ID BIGINT NOT NULL DEFAULT nextval('review_id_seq'),
+    ReviewText TEXT NOT NULL,
+    TenGrade INTEGER NOT NULL CHECK (TenGrade >= 1 AND TenGrade <= 10),
+    BinaryGrade BOOLEAN NOT NULL,
+    FilmID INTEGER NOT NULL,
+    UserID INTEGER NOT NULL,
+    PRIMARY KEY (FilmID, ID),
+    CONSTRAINT fk_user FOREIGN KEY (UserID) REFERENCES FILMUSER (ID),
+    CONSTRAINT fk_film FOREIGN KEY (FilmID) REFERENCES FILM (ID)
+) PARTITION BY HASH (FilmID);
+
+DO $$
+BEGIN
+    FOR i IN 0..15 LOOP
+        EXECUTE format(
+            'CREATE TABLE REVIEW_P%s PARTITION OF REVIEW_PARTITIONED FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+            lpad(i::text, 2, '0'), i
+        );
+    END LOOP;
+END;
+$$;
+
+CREATE INDEX review_partitioned_id_idx ON REVIEW_PARTITIONED (ID);
+-- Review lookup in create_or_update_review
+CREATE INDEX review_partitioned_film_user_idx ON REVIEW_PARTITIONED (FilmID, UserID);
+-- Foreign key checks on FILMUSER and per-user listings
+CREATE INDEX review_partitioned_user_idx ON REVIEW_PARTITIONED (UserID, ID);
+
+-- The crud film aggregates look genres up per film, the primary key leads with GenreID
+CREATE INDEX film_genre_film_idx ON FILM_GENRE (FilmID, GenreID);
+
+-- Report the logical table name given as trigger argument when there is one
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    payload JSONB;
+    row_data JSONB;
+BEGIN
+    payload := jsonb_build_object('table', COALESCE(TG_ARGV[0], lower(TG_TABLE_NAME)), 'op', TG_OP);
+
+    IF TG_LEVEL = 'ROW' THEN
+        IF TG_OP = 'DELETE' THEN
+            row_data := to_jsonb(OLD);
+        ELSE
+            row_data := to_jsonb(NEW);
+        END IF;
+
+        payload := payload || (
+            SELECT COALESCE(jsonb_object_agg(key, value), '{}'::jsonb)
+            FROM jsonb_each(row_data)
+            WHERE key IN ('id', 'filmid', 'genreid', 'userid', 'email')
+        );
+    END IF;
+
+    PERFORM pg_notify('filmdb_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep the copy in sync while the backfill tool (api/backfill_reviews.py) runs.
+-- Rows the backfill has not reached yet are simply not found by DELETE.
+CREATE OR REPLACE FUNCTION mirror_review_to_partitioned()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM REVIEW_PARTITIONED WHERE FilmID = OLD.FilmID AND ID = OLD.ID;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO REVIEW_PARTITIONED (ID, ReviewText, TenGrade, BinaryGrade, FilmID, UserID)
+        VALUES (NEW.ID, NEW.ReviewText, NEW.TenGrade, NEW.BinaryGrade, NEW.FilmID, NEW.UserID);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER review_mirror_to_partitioned_trigger
+AFTER INSERT OR UPDATE OR DELETE ON REVIEW
+FOR EACH ROW EXECUTE FUNCTION mirror_review_to_partitioned();
+
+-- Swap the tables once the backfill has caught up. The old table is kept as
+-- REVIEW_UNPARTITIONED for rollback and can be dropped afterwards.
+CREATE OR REPLACE PROCEDURE finish_review_partitioning()
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    LOCK TABLE REVIEW IN ACCESS EXCLUSIVE MODE;
+
+    DROP TRIGGER review_mirror_to_partitioned_trigger ON REVIEW;
+    ALTER TABLE REVIEW RENAME TO REVIEW_UNPARTITIONED;
+    ALTER TABLE REVIEW_PARTITIONED RENAME TO REVIEW;
+    ALTER SEQUENCE review_id_seq AS BIGINT;
+    ALTER SEQUENCE review_id_seq OWNED BY REVIEW.ID;
+
+    CREATE TRIGGER update_film_rating_trigger
+    AFTER INSERT OR UPDATE ON REVIEW
+    FOR EACH ROW EXECUTE FUNCTION update_film_rating();
+
+    -- Row triggers are cloned onto the partitions, where TG_TABLE_NAME is the
+    -- partition name, so the table reported to listeners is passed explicitly
+    CREATE TRIGGER review_notify_change_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON REVIEW
+    FOR EACH ROW EXECUTE FUNCTION notify_change('review');
+
+    CREATE TRIGGER review_notify_truncate_trigger
+    AFTER TRUNCATE ON REVIEW
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change('review');
+END;
+$$;
+
+-- Fresh databases have nothing to backfill and switch right away
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM REVIEW) THEN
+        CALL finish_review_partitioning();
+    END IF;
+END;
+$$;
@@ -0,0 +1,7 @@
+-- Substring search on film titles (ILIKE '%...%') uses trigram indexes
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX film_filmname_trgm_idx ON FILM USING GIN (FilmName gin_trgm_ops);
+
+-- Year and decade filters of search and its facets
+CREATE INDEX film_year_idx ON FILM (Year);
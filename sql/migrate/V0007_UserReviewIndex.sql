@@ -0,0 +1,10 @@
+-- Per-user review history pages by (UserID, ID). Once REVIEW is the hash-partitioned
+-- table it already has review_partitioned_user_idx, the unpartitioned table still
+-- in use before finish_review_partitioning() needs its own.
+DO $$
+BEGIN
+    IF to_regclass('review_partitioned') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS review_user_idx ON REVIEW (UserID, ID);
+    END IF;
+END;
+$$;
@@ -0,0 +1,74 @@
+-- Precomputed film cards (film, genres, rating, review count) for anonymous
+-- listing traffic. api/snapshot.py refreshes the view CONCURRENTLY, which
+-- needs the unique index, and records the time in FILM_CARD_REFRESH so readers
+-- can tell how stale it is. The time lives in its own single-row table: a
+-- timestamp column in the view would change every row and defeat the
+-- concurrent refresh, which only rewrites rows that differ.
+CREATE OR REPLACE PROCEDURE create_film_card()
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    CREATE MATERIALIZED VIEW FILM_CARD AS
+    SELECT f.ID AS id, f.FilmName AS filmname, f.Description AS description, f.Year AS year,
+           COALESCE(g.genres, ARRAY[]::text[]) AS genres,
+           COALESCE(r.average_rating, 0) AS average_rating,
+           COALESCE(r.review_count, 0) AS review_count
+    FROM FILM f
+    LEFT JOIN (
+        SELECT fg.FilmID, array_agg(g.GenreName ORDER BY g.GenreName) AS genres
+        FROM FILM_GENRE fg
+        JOIN GENRE g ON fg.GenreID = g.ID
+        GROUP BY fg.FilmID
+    ) g ON g.FilmID = f.ID
+    LEFT JOIN (
+        SELECT FilmID, round(AVG(TenGrade), 2) AS average_rating, COUNT(*) AS review_count
+        FROM REVIEW
+        GROUP BY FilmID
+    ) r ON r.FilmID = f.ID;
+
+    CREATE UNIQUE INDEX film_card_id_idx ON FILM_CARD (id);
+END;
+$$;
+
+CALL create_film_card();
+
+CREATE TABLE FILM_CARD_REFRESH (
+    ID BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (ID),
+    RefreshedAt TIMESTAMPTZ NOT NULL
+);
+
+INSERT INTO FILM_CARD_REFRESH (RefreshedAt) VALUES (now());
+
+-- The view keeps pointing at the table it was built from, so the switch to
+-- the partitioned review table has to rebuild it
+CREATE OR REPLACE PROCEDURE finish_review_partitioning()
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    LOCK TABLE REVIEW IN ACCESS EXCLUSIVE MODE;
+
+    DROP TRIGGER review_mirror_to_partitioned_trigger ON REVIEW;
+    ALTER TABLE REVIEW RENAME TO REVIEW_UNPARTITIONED;
+    ALTER TABLE REVIEW_PARTITIONED RENAME TO REVIEW;
+    ALTER SEQUENCE review_id_seq AS BIGINT;
+    ALTER SEQUENCE review_id_seq OWNED BY REVIEW.ID;
+
+    CREATE TRIGGER update_film_rating_trigger
+    AFTER INSERT OR UPDATE ON REVIEW
+    FOR EACH ROW EXECUTE FUNCTION update_film_rating();
+
+    -- Row triggers are cloned onto the partitions, where TG_TABLE_NAME is the
+    -- partition name, so the table reported to listeners is passed explicitly
+    CREATE TRIGGER review_notify_change_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON REVIEW
+    FOR EACH ROW EXECUTE FUNCTION notify_change('review');
+
+    CREATE TRIGGER review_notify_truncate_trigger
+    AFTER TRUNCATE ON REVIEW
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_change('review');
+
+    DROP MATERIALIZED VIEW FILM_CARD;
+    CALL create_film_card();
+    UPDATE FILM_CARD_REFRESH SET RefreshedAt = now();
+END;
+$$;
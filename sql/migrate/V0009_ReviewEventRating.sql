@@ -0,0 +1,39 @@
+-- Review events also carry the grades and the film's new rating and review
+-- count, so the API can push them to film pages (GET /films/{id}/events)
+-- without querying the database once per event. The aggregate reads a single
+-- review partition and runs next to the rating trigger's own.
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    payload JSONB;
+    row_data JSONB;
+BEGIN
+    payload := jsonb_build_object('table', COALESCE(TG_ARGV[0], lower(TG_TABLE_NAME)), 'op', TG_OP);
+
+    IF TG_LEVEL = 'ROW' THEN
+        IF TG_OP = 'DELETE' THEN
+            row_data := to_jsonb(OLD);
+        ELSE
+            row_data := to_jsonb(NEW);
+        END IF;
+
+        payload := payload || (
+            SELECT COALESCE(jsonb_object_agg(key, value), '{}'::jsonb)
+            FROM jsonb_each(row_data)
+            WHERE key IN ('id', 'filmid', 'genreid', 'userid', 'email', 'tengrade', 'binarygrade')
+        );
+
+        IF payload->>'table' = 'review' THEN
+            payload := payload || (
+                SELECT jsonb_build_object('average_rating', COALESCE(round(AVG(TenGrade), 2), 0),
+                                          'review_count', COUNT(*))
+                FROM REVIEW
+                WHERE FilmID = (row_data->>'filmid')::INTEGER
+            );
+        END IF;
+    END IF;
+
+    PERFORM pg_notify('filmdb_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
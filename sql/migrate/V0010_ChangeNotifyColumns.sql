@@ -0,0 +1,52 @@
+-- UPDATE events also list the columns whose value changed, so listeners can
+-- ignore changes that don't concern them: the rating trigger rewrites FILM on
+-- every review write, but only title and year feed the autocomplete index and
+-- the search facets. Updates that change nothing are not announced at all.
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    payload JSONB;
+    row_data JSONB;
+    changed JSONB;
+BEGIN
+    payload := jsonb_build_object('table', COALESCE(TG_ARGV[0], lower(TG_TABLE_NAME)), 'op', TG_OP);
+
+    IF TG_LEVEL = 'ROW' THEN
+        IF TG_OP = 'DELETE' THEN
+            row_data := to_jsonb(OLD);
+        ELSE
+            row_data := to_jsonb(NEW);
+        END IF;
+
+        IF TG_OP = 'UPDATE' THEN
+            SELECT COALESCE(jsonb_agg(new_row.key ORDER BY new_row.key), '[]'::jsonb)
+            INTO changed
+            FROM jsonb_each(row_data) new_row
+            WHERE new_row.value IS DISTINCT FROM to_jsonb(OLD) -> new_row.key;
+
+            IF changed = '[]'::jsonb THEN
+                RETURN NULL;
+            END IF;
+            payload := payload || jsonb_build_object('changed', changed);
+        END IF;
+
+        payload := payload || (
+            SELECT COALESCE(jsonb_object_agg(key, value), '{}'::jsonb)
+            FROM jsonb_each(row_data)
+            WHERE key IN ('id', 'filmid', 'genreid', 'userid', 'email', 'tengrade', 'binarygrade')
+        );
+
+        IF payload->>'table' = 'review' THEN
+            payload := payload || (
+                SELECT jsonb_build_object('average_rating', COALESCE(round(AVG(TenGrade), 2), 0),
+                                          'review_count', COUNT(*))
+                FROM REVIEW
+                WHERE FilmID = (row_data->>'filmid')::INTEGER
+            );
+        END IF;
+    END IF;
+
+    PERFORM pg_notify('filmdb_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,40 @@
+-- New genres are inserted in name order. Two admins adding overlapping new
+-- genre names in different orders could otherwise each wait, through
+-- ON CONFLICT, on a row the other inserted first and deadlock.
+CREATE OR REPLACE FUNCTION sync_film_genres(film_id INTEGER, genre_names TEXT[])
+RETURNS VOID AS $$
+BEGIN
+    WITH wanted AS (
+        SELECT DISTINCT name AS genrename
+        FROM unnest(genre_names) AS name
+        WHERE name IS NOT NULL
+    ),
+    existing AS (
+        SELECT g.ID AS genreid, g.GenreName
+        FROM GENRE g
+        JOIN wanted w ON w.genrename = g.GenreName
+    ),
+    created AS (
+        INSERT INTO GENRE (GenreName)
+        SELECT w.genrename
+        FROM wanted w
+        WHERE NOT EXISTS (SELECT 1 FROM existing e WHERE e.GenreName = w.genrename)
+        ORDER BY w.genrename
+        ON CONFLICT (GenreName) DO UPDATE SET GenreName = EXCLUDED.GenreName
+        RETURNING ID AS genreid
+    ),
+    resolved AS (
+        SELECT genreid FROM existing
+        UNION ALL
+        SELECT genreid FROM created
+    ),
+    removed AS (
+        DELETE FROM FILM_GENRE fg
+        WHERE fg.FilmID = film_id
+          AND fg.GenreID NOT IN (SELECT genreid FROM resolved)
+    )
+    INSERT INTO FILM_GENRE (FilmID, GenreID)
+    SELECT film_id, genreid FROM resolved
+    ON CONFLICT DO NOTHING;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,5 @@
+-- How long the last film_card refresh took. api/snapshot.py keeps the time
+-- between two refreshes a multiple of it, so a catalog large enough to make
+-- the refresh expensive is refreshed less often instead of keeping the
+-- primary busy rebuilding the view.
+ALTER TABLE FILM_CARD_REFRESH ADD COLUMN Duration DOUBLE PRECISION NOT NULL DEFAULT 0;
@@ -0,0 +1,108 @@
+"""Per-route Python overhead of the API, measured with TestClient against MemoryRepository.
+
+No database is involved, so the numbers cover routing, admission, dependency
+resolution, auth, validation and serialization. /metrics is the floor: the
+cost of a request that does almost nothing.
+
+    python tests/api/bench_routes.py --films 1000 --requests 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+# One client hammers one process, admission rate limits would only get in the way
+for route_class in ("READ", "AGGREGATE", "WRITE", "LOGIN"):
+    os.environ[f"ADMISSION_{route_class}_RATE"] = "1e9"
+    os.environ[f"ADMISSION_{route_class}_BURST"] = "1e9"
+os.environ["DATABASE_URL"] = ""
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "api"))
+
+from fastapi.testclient import TestClient
+import main, database, schemas
+from database import get_db, get_read_db
+from memory_repository import MemoryRepository
+
+GENRES = ["Драма", "Комедия", "Боевик", "Фантастика", "Триллер", "Мелодрама"]
+
+def seed(repo, films: int, users: int):
+    for i in range(users):
+        repo.create_user(schemas.UserCreate(email=f"user{i}@example.com", name=f"User {i}", password="secret",
+                                            dateofbirth=date(1990, 1, 1)))
+    for i in range(films):
+        film = repo.create_film(schemas.FilmCreate(filmname=f"Film {i}", year=1950 + i % 70, description="Description " * 20,
+                                                   genres=[GENRES[i % len(GENRES)], GENRES[(i * 7) % len(GENRES)]]))
+        for user_id in range(1, 1 + i % (users + 1)):
+            repo.create_or_update_review({"reviewtext": "Review " * 30, "tengrade": 1 + (i + user_id) % 10,
+                                          "binarygrade": True}, film["id"], user_id)
+
+def routes(film_id: int):
+    review = {"reviewtext": "Updated review", "tengrade": 7, "binarygrade": True}
+    return [
+        ("GET", "/metrics", None),
+        ("GET", "/films/?limit=100", None),
+        ("GET", "/films/?limit=100&fields=filmname,year", None),
+        ("GET", f"/films/{film_id}", None),
+        ("GET", f"/films/{film_id}/reviews", None),
+        ("GET", f"/films/{film_id}/reviews?fields=reviewtext,user.name", None),
+        ("GET", "/reviews/?limit=100", None),
+        ("GET", "/films/search/?name=film 1", None),
+        ("GET", "/films/search/facets?limit=20", None),
+        ("GET", "/films/autocomplete?q=fi", None),
+        ("GET", "/genres/", None),
+        ("GET", "/users/me", None),
+        ("POST", f"/films/{film_id}/reviews", review),
+    ]
+
+def measure(client, method, url, body, headers, requests: int, warmup: int):
+    for _ in range(warmup):
+        client.request(method, url, json=body, headers=headers)
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter_ns()
+        response = client.request(method, url, json=body, headers=headers)
+        timings.append((time.perf_counter_ns() - started) / 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.text}")
+    timings.sort()
+    return {
+        "mean": statistics.fmean(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[int(len(timings) * 0.95)],
+        "p99": timings[int(len(timings) * 0.99)],
+    }
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--films", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=5, help="reviewers, each costs a bcrypt hash to create")
+    parser.add_argument("--requests", type=int, default=500, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--route", help="only benchmark routes containing this substring")
+    args = parser.parse_args()
+
+    repo = MemoryRepository()
+    seed(repo, args.films, args.users)
+
+    def override():
+        yield repo
+    main.app.dependency_overrides[get_db] = override
+    main.app.dependency_overrides[get_read_db] = override
+    database.acquire = lambda: repo
+    database.release = lambda conn: None
+    headers = {"Authorization": f"Bearer {main.create_access_token({'sub': 'user0@example.com'})}"}
+    film_id = max(repo.films)
+
+    print(f"{args.films} films, {len(repo.reviews)} reviews, {args.requests} requests per route, times in µs")
+    print(f"{'route':<60} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    with TestClient(main.app) as client:
+        for method, url, body in routes(film_id):
+            if args.route and args.route not in url:
+                continue
+            result = measure(client, method, url, body, headers, args.requests, args.warmup)
+            print(f"{method + ' ' + url:<60} " + " ".join(f"{result[key]:>8.0f}" for key in ("mean", "p50", "p95", "p99")))
+
+if __name__ == "__main__":
+    main_()
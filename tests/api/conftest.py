@@ -0,0 +1,51 @@
+import os
+import sys
+from datetime import date
+import pytest
+
+# The API runs against MemoryRepository here, never against a database
+os.environ["DATABASE_URL"] = ""
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "api"))
+
+from fastapi.testclient import TestClient
+import main, admission, autocomplete, database, schemas
+from database import get_db, get_read_db
+from memory_repository import MemoryRepository
+
+@pytest.fixture
+def repo():
+    return MemoryRepository()
+
+@pytest.fixture
+def client(repo, monkeypatch):
+    def override():
+        yield repo
+    main.app.dependency_overrides[get_db] = override
+    main.app.dependency_overrides[get_read_db] = override
+    monkeypatch.setattr(database, "acquire", lambda: repo)
+    monkeypatch.setattr(database, "release", lambda conn: None)
+    monkeypatch.setattr(autocomplete, "index", autocomplete.TitleIndex())
+    for route_class in (admission.READ, admission.AGGREGATE, admission.WRITE, admission.LOGIN):
+        route_class._buckets.clear()
+    with TestClient(main.app) as test_client:
+        yield test_client
+    main.app.dependency_overrides.clear()
+
+def make_user(repo, email, role="user", password="secret"):
+    user = repo.create_user(schemas.UserCreate(email=email, name=email.split("@")[0], password=password,
+                                               dateofbirth=date(1990, 1, 1)))
+    repo.users[user['id']]['role'] = role
+    return user
+
+def auth_headers(email):
+    return {"Authorization": f"Bearer {main.create_access_token({'sub': email})}"}
+
+@pytest.fixture
+def user_headers(repo):
+    make_user(repo, "viewer@example.com")
+    return auth_headers("viewer@example.com")
+
+@pytest.fixture
+def admin_headers(repo):
+    make_user(repo, "admin@example.com", role=main.FILMADMIN)
+    return auth_headers("admin@example.com")
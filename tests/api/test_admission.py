@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+import admission
+
+def route_class(**overrides):
+    settings = dict(concurrency=1, queue=2, max_wait=0.5, rate=1, burst=2)
+    settings.update(overrides)
+    return admission.RouteClass("test", **settings)
+
+def test_waiters_are_admitted_in_order():
+    limits = route_class()
+
+    async def scenario():
+        await limits.acquire()
+        admitted = []
+
+        async def wait(name):
+            await limits.acquire()
+            admitted.append(name)
+
+        waiters = [asyncio.create_task(wait(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        assert len(limits._waiters) == 2 and not admitted
+
+        limits.release()
+        await asyncio.sleep(0.01)  # the handed-over slot passes through wait_for and shield
+        assert admitted == ["first"] and limits.active == 1
+        limits.release()
+        await asyncio.gather(*waiters)
+        assert admitted == ["first", "second"]
+        limits.release()
+        assert limits.active == 0
+
+    asyncio.run(scenario())
+
+def test_full_queue_is_shed():
+    limits = route_class(queue=1)
+
+    async def scenario():
+        await limits.acquire()
+        waiter = asyncio.create_task(limits.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as rejected:
+            await limits.acquire()
+        assert rejected.value.status_code == 503 and rejected.value.headers["Retry-After"] == "1"
+        limits.release()
+        await waiter
+
+    asyncio.run(scenario())
+
+def test_expected_wait_over_budget_is_shed():
+    limits = route_class()
+    limits.avg_service_time = 2.0
+
+    async def scenario():
+        await limits.acquire()
+        with pytest.raises(HTTPException) as rejected:
+            await limits.acquire()
+        assert rejected.value.status_code == 503 and rejected.value.headers["Retry-After"] == "2"
+        assert not limits._waiters
+
+    asyncio.run(scenario())
+
+def test_wait_times_out():
+    limits = route_class(max_wait=0.05)
+
+    async def scenario():
+        await limits.acquire()
+        with pytest.raises(HTTPException) as rejected:
+            await limits.acquire()
+        assert rejected.value.status_code == 503
+        # The abandoned waiter doesn't keep the slot from being freed
+        assert not limits._waiters
+        limits.release()
+        assert limits.active == 0
+
+    asyncio.run(scenario())
+
+def test_rate_limit_per_client():
+    limits = route_class(rate=0.001, burst=2)
+    limits.check_rate("ip:1")
+    limits.check_rate("ip:1")
+    with pytest.raises(HTTPException) as limited:
+        limits.check_rate("ip:1")
+    assert limited.value.status_code == 429
+    limits.check_rate("ip:2")
+
+def test_rate_limited_route(client, monkeypatch):
+    monkeypatch.setattr(admission.LOGIN, "burst", 1)
+    form = {"username": "nobody@example.com", "password": "wrong"}
+    assert client.post("/token", data=form).status_code == 401
+    response = client.post("/token", data=form)
+    assert response.status_code == 429 and "Retry-After" in response.headers
@@ -0,0 +1,50 @@
+from .conftest import make_user
+
+def test_register_and_login(client):
+    response = client.post("/users/", json={
+        "email": "new@example.com", "name": "New", "password": "secret", "dateofbirth": "1990-05-01"
+    })
+    assert response.status_code == 200
+    assert response.json()["role"] == "user"
+
+    response = client.post("/token", data={"username": "new@example.com", "password": "secret"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["email"] == "new@example.com"
+
+def test_register_rejects_duplicates_and_children(client, repo):
+    make_user(repo, "taken@example.com")
+    response = client.post("/users/", json={
+        "email": "taken@example.com", "name": "Taken", "password": "secret", "dateofbirth": "1990-05-01"
+    })
+    assert response.status_code == 403
+
+    response = client.post("/users/", json={
+        "email": "kid@example.com", "name": "Kid", "password": "secret", "dateofbirth": "2020-05-01"
+    })
+    assert response.status_code == 403
+
+def test_wrong_password(client, repo):
+    make_user(repo, "user@example.com")
+    response = client.post("/token", data={"username": "user@example.com", "password": "wrong"})
+    assert response.status_code == 401
+
+def test_users_listing(client, repo):
+    make_user(repo, "user@example.com")
+    response = client.get("/users/")
+    assert [user["email"] for user in response.json()] == ["user@example.com"]
+
+def test_tokens_resolve_the_same_everywhere(client, repo, user_headers, monkeypatch):
+    from types import SimpleNamespace
+    import main
+    monkeypatch.setattr(main.admission, "client_ip", lambda request: "10.0.0.1")
+    keys = [main.rate_limit_key(SimpleNamespace(headers={k.lower(): v for k, v in headers.items()}))
+            for headers in (user_headers, {"Authorization": "Bearer junk"}, {})]
+    assert keys == ["user:viewer@example.com", "ip:10.0.0.1", "ip:10.0.0.1"]
+
+    assert main.profile_owner(user_headers["Authorization"])["email"] == "viewer@example.com"
+    assert main.profile_owner("Bearer junk") is None
+    assert main.profile_owner(f"Bearer {main.create_access_token({'sub': 'gone@example.com'})}") is None
+    assert client.get("/users/me", headers=user_headers).json()["email"] == "viewer@example.com"
@@ -0,0 +1,176 @@
+from types import SimpleNamespace
+import pytest
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+import compression
+import database
+import snapshot
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, br", "br"),
+    ("br;q=0.1, gzip;q=1", "gzip"),
+    ("gzip;q=0.5, br;q=0.5", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("*;q=0.2, gzip;q=0.1", "br"),
+    ("identity", None),
+    ("gzip;q=.", None),
+    ("br;q=1.0.0, gzip", "gzip"),
+    ("", None),
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert compression.choose_encoding(accept_encoding) == expected
+
+@pytest.fixture
+def listing(monkeypatch):
+    """A /films/ route behind the middleware that counts how often it runs and whether it read the primary."""
+    monkeypatch.setattr(compression, "response_cache", compression.LocalCache(ttl=30))
+    monkeypatch.setattr(compression, "_invalidated", {})
+    app = FastAPI()
+    calls = []
+
+    @app.get("/films/")
+    def films(request: Request):
+        calls.append(getattr(request.state, "read_primary", False))
+        return [{"id": film_id, "filmname": "Матрица" * 10} for film_id in range(20)]
+
+    @app.get("/films/{film_id}/reviews")
+    def film_reviews(film_id: int, request: Request):
+        calls.append((film_id, getattr(request.state, "read_primary", False)))
+        return [{"id": 1, "filmid": film_id}]
+
+    @app.post("/films/")
+    def create_film():
+        return {"id": 21}
+
+    app.add_middleware(compression.CompressionMiddleware, minimum_size=100)
+    return TestClient(app), calls
+
+def test_malformed_accept_encoding_is_not_an_error(client):
+    assert client.get("/healthz", headers={"Accept-Encoding": "gzip;q=."}).status_code == 200
+
+def test_cache_hits_and_encodings(listing):
+    client, calls = listing
+    plain = client.get("/films/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    compressed = client.get("/films/", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.json() == plain.json()
+    # One miss, filled from a replica as nothing changed lately, then served from the cache
+    assert calls == [False]
+
+    assert client.get("/films/", headers={"Authorization": "Bearer x"}).status_code == 200
+    assert client.get("/films/?skip=20").status_code == 200
+    assert calls == [False, False, False]
+
+def test_writes_invalidate(listing):
+    client, calls = listing
+    client.get("/films/")
+    client.post("/films/")
+    client.get("/films/")
+    # Refilled from the primary, a replica may not have replayed the write yet
+    assert calls == [False, True]
+
+    compression.invalidate()
+    client.get("/films/")
+    assert len(calls) == 3
+
+def test_invalidation_drops_only_tagged_pages(listing, monkeypatch):
+    client, calls = listing
+    for path in ("/films/", "/films/1/reviews", "/films/2/reviews"):
+        client.get(path)
+    assert len(calls) == 3
+
+    compression.invalidate("films", "reviews", "film:1")
+    for path in ("/films/", "/films/1/reviews", "/films/2/reviews"):
+        client.get(path)
+    assert calls[3:] == [True, (1, True)]
+
+    # Past the window a miss goes back to the replica
+    monkeypatch.setattr(compression, "RESPONSE_CACHE_PRIMARY_SECONDS", 0)
+    compression.invalidate("film:2")
+    client.get("/films/2/reviews")
+    assert calls[5:] == [(2, False)]
+
+def test_fill_racing_an_invalidation_is_not_stored(listing, monkeypatch):
+    client, calls = listing
+    monkeypatch.setattr(compression, "_invalidations", 0)
+    cached = compression.CachedResponse(200, [], b"[]", ("film:1", "film_reviews"))
+    compression.invalidate("film:1")
+    compression._store("/films/1/reviews?", cached, since=0)
+    compression._store("/films/1/reviews?x", cached, since=1)
+    assert compression.response_cache.get("/films/1/reviews?") is None
+    assert compression.response_cache.get("/films/1/reviews?x") is cached
+
+def test_change_events_invalidate_their_pages(monkeypatch):
+    import main
+    dropped = []
+    monkeypatch.setattr(compression, "invalidate", lambda *tags: dropped.append(tags))
+    main.invalidate_review_responses({"table": "review", "op": "INSERT", "id": 5, "filmid": 3})
+    # The rating trigger's film update and a new user change nothing that is cached
+    main.invalidate_film_responses({"table": "film", "op": "UPDATE", "id": 3, "changed": ["average_rating"]})
+    main.invalidate_reviewer_responses({"table": "filmuser", "op": "INSERT", "id": 9})
+    main.invalidate_film_responses({"table": "film", "op": "UPDATE", "id": 3, "changed": ["filmname"]})
+    assert dropped == [("films", "reviews", "film:3")] * 2
+
+def test_cache_fills_read_the_primary(monkeypatch):
+    monkeypatch.setattr(database, "connect_replica", lambda: "replica")
+    monkeypatch.setattr(database, "acquire", lambda: "primary")
+    monkeypatch.setattr(database, "release", lambda conn: None)
+
+    def read_with(state):
+        request = SimpleNamespace(state=SimpleNamespace(**state))
+        dependency = database.get_read_db(request)
+        conn = next(dependency)
+        dependency.close()
+        return conn
+
+    assert read_with({}) == "replica"
+    assert read_with({"read_primary": True}) == "primary"
+
+def test_snapshot_pages_keep_their_staleness_bound(monkeypatch):
+    monkeypatch.setattr(compression, "response_cache", compression.LocalCache(ttl=30))
+    monkeypatch.setattr(compression, "_invalidated", {})
+    app = FastAPI()
+    calls = []
+
+    @app.get("/films/")
+    def films(request: Request, response: Response, max_staleness: float = 60):
+        calls.append(max_staleness)
+        response.headers["X-Snapshot-Age"] = "1.0"
+        request.state.cache_ttl = max_staleness - 1.0
+        return [{"id": 1}]
+
+    app.add_middleware(compression.CompressionMiddleware)
+    client = TestClient(app)
+
+    client.get("/films/")
+    cached = compression.response_cache.get("/films/?")
+    cached.cached_at -= 5
+    # Served from the cache, the age includes the time spent there
+    assert client.get("/films/").headers["X-Snapshot-Age"] == "6.0"
+
+    client.get("/films/?max_staleness=1")
+    client.get("/films/?max_staleness=1")
+    assert calls == [60, 1, 1]
+
+    # Only a snapshot refresh drops snapshot pages
+    compression.invalidate("films")
+    assert compression.response_cache.get("/films/?") is cached
+    compression.invalidate("snapshot")
+    assert compression.response_cache.get("/films/?") is None
+
+def test_snapshot_bound_caps_the_cache_ttl(repo):
+    request = SimpleNamespace(headers={}, state=SimpleNamespace())
+    assert snapshot.age_for(request, repo, max_staleness=5) == 0.0
+    assert request.state.cache_ttl == 5
+
+def test_a_review_write_counts_once_towards_a_snapshot_refresh(monkeypatch):
+    import main
+    counted = []
+    monkeypatch.setattr(snapshot, "record_change", lambda: counted.append(1))
+    main.count_snapshot_changes({"table": "review", "op": "INSERT", "id": 5, "filmid": 3})
+    main.count_snapshot_changes({"table": "film", "op": "UPDATE", "id": 3, "changed": ["average_rating"]})
+    assert len(counted) == 1
+    main.count_snapshot_changes({"table": "film", "op": "UPDATE", "id": 3, "changed": ["year"]})
+    assert len(counted) == 2
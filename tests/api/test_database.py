@@ -0,0 +1,170 @@
+from types import SimpleNamespace
+import pytest
+import crud
+import database
+import singleflight
+import warmup
+
+class FakeConnection:
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.closed = 0
+        self.readonly = None
+        self.rollbacks = 0
+        self.cursor_factory = None
+        self.pings = 0
+        self.server_gone = False
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def set_session(self, readonly):
+        self.readonly = readonly
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, query):
+                conn.pings += 1
+                if conn.server_gone:
+                    conn.closed = 2
+                    raise database.psycopg2.OperationalError("server closed the connection unexpectedly")
+        return Cursor()
+
+class FakePool:
+    def __init__(self, minconn, maxconn, dsn, **kwargs):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.idle = [FakeConnection(dsn) for _ in range(minconn)]
+        self.handed_out = 0
+        self.returned = []
+
+    def getconn(self):
+        if self.handed_out >= self.maxconn:
+            raise database.PoolError("connection pool exhausted")
+        self.handed_out += 1
+        return self.idle.pop() if self.idle else FakeConnection(self.dsn)
+
+    def putconn(self, conn, close=False):
+        self.handed_out -= 1
+        self.returned.append((conn, close))
+        if not close:
+            self.idle.append(conn)
+
+    def closeall(self):
+        self.closed = True
+
+@pytest.fixture
+def pools(monkeypatch):
+    monkeypatch.setattr(database, "ThreadedConnectionPool", FakePool)
+    monkeypatch.setattr(database, "DATABASE_URL", "primary")
+    monkeypatch.setattr(database, "DATABASE_READ_URLS", ["replica"])
+    monkeypatch.setattr(database, "_replica_cycle", iter(lambda: "replica", None))
+    monkeypatch.setattr(database, "_replica_down_until", {})
+    monkeypatch.setattr(database, "DB_POOL_MIN", 2)
+    monkeypatch.setattr(database, "DB_POOL_MAX", 3)
+    monkeypatch.setattr(database, "connect", lambda: FakeConnection("one-off"))
+    database.open_pool()
+    yield database._pools
+    database.close_pool()
+
+def test_connections_return_to_their_pool(pools):
+    primary, replica = database.acquire(), database.connect_replica()
+    assert (primary.dsn, replica.dsn, replica.readonly) == ("primary", "replica", True)
+    assert database.pool_state()["in_use"] == {"primary": 1, "replica1": 1}
+
+    primary.cursor_factory = "TimedCursor"
+    database.release(primary)
+    database.release(replica)
+    assert primary.rollbacks == 1 and primary.cursor_factory is database.RealDictCursor
+    assert pools["primary"].returned == [(primary, False)]
+    assert pools["replica"].returned == [(replica, False)]
+    assert database.pool_state()["in_use"] == {"primary": 0, "replica1": 0}
+
+def test_exhausted_pool_hands_out_one_off_connections(pools):
+    held = [database.acquire() for _ in range(3)]
+    extra = database.acquire()
+    assert extra.dsn == "one-off"
+    database.release(extra)
+    assert extra.closed and pools["primary"].handed_out == 3
+    for conn in held:
+        database.release(conn)
+
+def test_broken_connections_are_dropped(pools):
+    conn = database.acquire()
+    conn.closed = 2
+    database.release(conn)
+    assert pools["primary"].returned == [(conn, True)]
+
+def test_warm_up_runs_on_every_pooled_connection(pools, monkeypatch):
+    ran_on = []
+    for name in ("get_genres", "get_snapshot_age", "get_films", "get_snapshot_films"):
+        monkeypatch.setattr(getattr(crud, name), "__wrapped__", lambda conn, **kwargs: ran_on.append(conn))
+    # A live request's identical query in flight must not absorb the warm-up query
+    monkeypatch.setitem(singleflight._calls, ("get_genres", "primary", (), ()), SimpleNamespace())
+
+    warmup._run_hot_queries()
+    assert {conn.dsn for conn in ran_on} == {"primary", "replica"}
+    assert len({id(conn) for conn in ran_on}) == 4
+    assert database.pool_state()["in_use"] == {"primary": 0, "replica1": 0}
+
+def test_opening_a_pool_does_not_block_other_servers(pools, monkeypatch):
+    import threading
+    connecting = threading.Event()
+    unblock = threading.Event()
+
+    class SlowPool(FakePool):
+        def __init__(self, *args, **kwargs):
+            connecting.set()
+            unblock.wait(2)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(database, "ThreadedConnectionPool", SlowPool)
+    monkeypatch.setattr(database, "DATABASE_READ_URLS", ["replica", "replica2"])
+    opener = threading.Thread(target=database._replica_pool, args=("replica2",))
+    opener.start()
+    try:
+        assert connecting.wait(2)
+        # Checkouts, releases and /readyz carry on while replica2 connects
+        conn = database.acquire()
+        database.release(conn)
+        assert database.pool_state()["in_use"] == {"primary": 0, "replica1": 0}
+    finally:
+        unblock.set()
+        opener.join()
+    assert database.pool_state()["in_use"] == {"primary": 0, "replica1": 0, "replica2": 0}
+
+def test_a_lost_replica_connection_drops_its_pool(pools):
+    replica_pool = pools["replica"]
+    conn = database.connect_replica()
+    conn.closed = 2
+    database.release(conn)
+    # The replica is skipped for a while and its pool, full of dead connections, is gone
+    assert replica_pool.closed and "replica" not in pools
+    assert database.connect_replica() is None
+    assert database.pool_state()["in_use"] == {"primary": 0}
+
+def test_idle_replica_connections_are_checked(pools, monkeypatch):
+    conn = database.connect_replica()
+    database.release(conn)
+    assert database.connect_replica() is conn and conn.pings == 0
+    database.release(conn)
+
+    monkeypatch.setattr(database, "REPLICA_CHECK_IDLE_SECONDS", 0)
+    conn.server_gone = True
+    assert database.connect_replica() is None
+    assert conn.pings == 1 and "replica" not in pools
+
+def test_pool_holds_every_admitted_request():
+    import admission
+    assert database.DB_POOL_MAX >= admission.total_concurrency()
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from psycopg2.errors import QueryCanceled
+import deadlines
+import metrics
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.cancels = 0
+        self.statements = []
+        self.cancel_seconds = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+
+    def cancel(self):
+        time.sleep(self.cancel_seconds)
+        self.cancels += 1
+
+class FakeRequest:
+    def __init__(self, disconnect_after: int):
+        self.state = SimpleNamespace()
+        self.polls = 0
+        self.disconnect_after = disconnect_after
+
+    async def is_disconnected(self):
+        self.polls += 1
+        return self.polls > self.disconnect_after
+
+def test_apply_sets_a_transaction_timeout():
+    request = FakeRequest(disconnect_after=0)
+    request.state.query_deadline = 2.5
+    request.state.db_connections = []
+    request.state.db_connections_lock = threading.Lock()
+    conn = FakeConnection()
+    deadlines.apply(conn, request)
+    assert conn.statements == [("SET LOCAL statement_timeout = %s", (2500,))]
+    assert request.state.db_connections == [conn]
+
+    deadlines.forget(conn, request)
+    assert request.state.db_connections == []
+
+def test_routes_without_a_deadline_are_left_alone():
+    conn = FakeConnection()
+    deadlines.apply(conn, FakeRequest(disconnect_after=0))
+    assert conn.statements == []
+
+def test_disconnect_cancels_running_queries(monkeypatch):
+    monkeypatch.setattr(deadlines, "DISCONNECT_POLL_SECONDS", 0.001)
+    request = FakeRequest(disconnect_after=2)
+    conn, returned = FakeConnection(), FakeConnection()
+    before = metrics.snapshot().get("queries.cancelled.disconnect", 0)
+
+    async def scenario():
+        watch = deadlines.query_deadline(1)(request)
+        await anext(watch)
+        deadlines.apply(conn, request)
+        deadlines.apply(returned, request)
+        # Back in the pool before the client left, so it must not be cancelled
+        deadlines.forget(returned, request)
+        while not request.state.client_disconnected:
+            await asyncio.sleep(0.001)
+        assert deadlines.client_disconnected()
+        await watch.aclose()
+
+    asyncio.run(scenario())
+    assert conn.cancels == 1 and returned.cancels == 0
+    deadlines.record_cancellation(request)
+    assert metrics.snapshot()["queries.cancelled.disconnect"] == before + 1
+
+def test_exceeded_deadline_answers_504(client, repo, monkeypatch):
+    def cancelled(*args, **kwargs):
+        raise QueryCanceled("canceling statement due to statement timeout")
+    monkeypatch.setattr(repo, "get_film_reviews", cancelled)
+    before = metrics.snapshot().get("queries.cancelled.deadline", 0)
+
+    response = client.get("/films/1/reviews")
+    assert response.status_code == 504
+    assert metrics.snapshot()["queries.cancelled.deadline"] == before + 1
+
+def test_release_waits_for_a_cancel_in_progress():
+    state = SimpleNamespace(db_connections=[], db_connections_lock=threading.Lock())
+    request = SimpleNamespace(state=state)
+    conn = FakeConnection()
+    conn.cancel_seconds = 0.1
+    state.db_connections.append(conn)
+
+    canceller = threading.Thread(target=deadlines._cancel_all, args=(state,))
+    canceller.start()
+    time.sleep(0.02)
+    deadlines.forget(conn, request)
+    # Only now may the connection go back to the pool, the cancel has landed
+    assert conn.cancels == 1 and state.db_connections == []
+    canceller.join()
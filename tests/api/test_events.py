@@ -0,0 +1,31 @@
+import asyncio
+import events
+
+def test_unknown_film_has_no_stream(client):
+    assert client.get("/films/42/events").status_code == 404
+
+def test_fan_out_and_overflow(monkeypatch):
+    monkeypatch.setattr(events, "QUEUE_SIZE", 3)
+
+    async def scenario():
+        fast, slow, other_film = events.stream(1), events.stream(1), events.stream(2)
+        for stream in (fast, slow, other_film):
+            assert await anext(stream) == events.RETRY
+        assert events._count == 3
+
+        for review_id in range(5):
+            events.publish(1, "review", {"id": review_id, "average_rating": 7.5})
+            await asyncio.sleep(0)  # let the delivery callback run
+            if review_id < 2:
+                assert await anext(fast) == f'id: {review_id}\nevent: review\ndata: {{"id": {review_id}, "average_rating": 7.5}}\n\n'
+
+        assert [(await anext(fast)).split("\n")[0] for _ in range(3)] == ["id: 2", "id: 3", "id: 4"]
+        # The slow client fell 3 events behind, its backlog was replaced by a resync
+        assert await anext(slow) == events.RESYNC
+        assert (await anext(slow)).startswith("id: 4\n")
+
+        for stream in (fast, slow, other_film):
+            await stream.aclose()
+        assert events._count == 0
+
+    asyncio.run(scenario())
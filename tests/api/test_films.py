@@ -0,0 +1,120 @@
+import json
+import time
+import pytest
+import main
+
+@pytest.fixture
+def films(client, admin_headers):
+    created = []
+    for name, year, genres in [("Матрица", 1999, ["Фантастика", "Боевик"]),
+                               ("Жизнь Брайана", 1979, ["Комедия"]),
+                               ("Матрица: Перезагрузка", 2003, ["Фантастика"])]:
+        response = client.post("/films/", json={"filmname": name, "year": year, "description": name, "genres": genres},
+                               headers=admin_headers)
+        assert response.status_code == 200
+        created.append(response.json())
+    return created
+
+def test_create_film_requires_admin(client, user_headers):
+    response = client.post("/films/", json={"filmname": "Film", "year": 2000}, headers=user_headers)
+    assert response.status_code == 403
+
+def test_list_films(client, films):
+    response = client.get("/films/?limit=2")
+    assert response.headers["X-Total-Count"] == "3"
+    assert [film["filmname"] for film in response.json()] == ["Матрица", "Жизнь Брайана"]
+    assert response.json()[0]["genres"] == ["Боевик", "Фантастика"]
+    assert response.json()[0]["average_rating"] == 0
+
+def test_sparse_fields(client, films):
+    response = client.get("/films/?fields=filmname")
+    assert response.json()[0] == {"id": films[0]["id"], "filmname": "Матрица"}
+
+    response = client.get(f"/films/{films[1]['id']}?fields=year,genres")
+    assert response.json() == {"id": films[1]["id"], "year": 1979, "genres": ["Комедия"]}
+
+    assert client.get("/films/?fields=budget").status_code == 400
+
+def test_read_missing_film(client):
+    assert client.get("/films/42").status_code == 404
+
+def test_update_film_genres(client, films, admin_headers):
+    film_id = films[0]["id"]
+    response = client.post(f"/films/{film_id}/update", json={"year": 2000, "genres": ["Фантастика", "Киберпанк"]},
+                           headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()["genres"] == ["Киберпанк", "Фантастика"]
+    assert "Киберпанк" in [genre["genrename"] for genre in client.get("/genres/").json()]
+
+def test_search_and_facets(client, films):
+    response = client.get("/films/search/?name=матрица")
+    assert [film["year"] for film in response.json()] == [1999, 2003]
+
+    response = client.get("/films/search/facets?genre=Фантастика")
+    body = response.json()
+    assert body["total"] == 2
+    assert {"genre": "Комедия", "count": 1} in body["facets"]["genres"]
+    assert body["facets"]["decades"] == [{"decade": 1990, "count": 1}, {"decade": 2000, "count": 1}]
+
+def test_autocomplete(client, films):
+    response = client.get("/films/autocomplete?q=пере")
+    assert [film["filmname"] for film in response.json()] == ["Матрица: Перезагрузка"]
+
+def test_autocomplete_follows_title_edits(client, films, repo, monkeypatch):
+    monkeypatch.setattr(main.autocomplete, "REFRESH_DEBOUNCE_SECONDS", 0)
+    client.get("/films/autocomplete?q=мат")
+    film_id = films[0]["id"]
+    repo.films[film_id]["filmname"] = "Тринадцатый этаж"
+
+    # Rating updates from the review trigger don't touch the index
+    main.listener.dispatch(json.dumps({"table": "film", "op": "UPDATE", "id": film_id, "changed": ["average_rating"]}))
+    assert not main.autocomplete._pending
+
+    main.listener.dispatch(json.dumps({"table": "film", "op": "UPDATE", "id": film_id, "changed": ["filmname"]}))
+    for _ in range(100):
+        if client.get("/films/autocomplete?q=трин").json():
+            break
+        time.sleep(0.01)
+    assert [film["id"] for film in client.get("/films/autocomplete?q=трин").json()] == [film_id]
+    assert film_id not in [film["id"] for film in client.get("/films/autocomplete?q=мат").json()]
+
+def test_delete_film(client, films, admin_headers):
+    film_id = films[1]["id"]
+    assert client.delete(f"/films/{film_id}", headers=admin_headers).status_code == 204
+    assert client.get(f"/films/{film_id}").status_code == 404
+    assert client.delete(f"/films/{film_id}", headers=admin_headers).status_code == 404
+
+def test_snapshot_reads(client, films, user_headers):
+    response = client.get("/films/")
+    assert response.headers["X-Snapshot-Age"] == "0.0"
+    assert len(response.json()) == 3
+    assert "X-Snapshot-Age" in client.get(f"/films/{films[0]['id']}").headers
+
+    assert "X-Snapshot-Age" not in client.get("/films/?max_staleness=0").headers
+    assert "X-Snapshot-Age" not in client.get("/films/", headers=user_headers).headers
+
+def test_update_only_genres(client, films, admin_headers):
+    film_id = films[1]["id"]
+    response = client.post(f"/films/{film_id}/update", json={"genres": ["Драма"]}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()["genres"] == ["Драма"]
+    assert response.json()["year"] == 1979
+
+    assert client.post("/films/42/update", json={"genres": ["Драма"]}, headers=admin_headers).status_code == 404
+
+def test_facet_cache_invalidation(client, films, monkeypatch):
+    monkeypatch.setattr(main.listener, "is_connected", lambda: True)
+    main.facet_cache.clear()
+    assert client.get("/films/search/facets").json()["total"] == 3
+    assert main.facet_cache.get("catalog") is not None
+
+    # The rating trigger's film updates leave the facets alone
+    main.listener.dispatch(json.dumps({"table": "film", "op": "UPDATE", "id": films[0]["id"], "changed": ["average_rating"]}))
+    assert main.facet_cache.get("catalog") is not None
+
+    main.listener.dispatch(json.dumps({"table": "film", "op": "UPDATE", "id": films[0]["id"], "changed": ["year"]}))
+    assert main.facet_cache.get("catalog") is None
+
+    client.get("/films/search/facets")
+    main.listener.dispatch(json.dumps({"table": "film_genre", "op": "INSERT", "filmid": films[0]["id"], "genreid": 1}))
+    assert main.facet_cache.get("catalog") is None
@@ -0,0 +1,13 @@
+import warmup
+
+def test_health_and_readiness(client, monkeypatch):
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+    # Without a database there is nothing to warm up
+    body = client.get("/readyz").json()
+    assert body["ready"] is True and body["pool"] == {"open": False}
+
+    monkeypatch.setattr(warmup, "_ready", type(warmup._ready)())
+    response = client.get("/readyz")
+    assert response.status_code == 503 and response.json()["ready"] is False
+    assert client.get("/healthz").status_code == 200
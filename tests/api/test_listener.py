@@ -0,0 +1,49 @@
+import json
+from types import SimpleNamespace
+import listener
+
+class FakeConnection:
+    """Connection on which a notification arrives while the keepalive ping runs."""
+
+    def __init__(self):
+        self.notifies = []
+        self.pinged = False
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        if query == "SELECT 1" and not self.pinged:
+            self.pinged = True
+            self.notifies.append(SimpleNamespace(payload=json.dumps({"table": "genre", "op": "UPDATE", "id": 1})))
+
+    def poll(self):
+        pass
+
+def test_notifications_during_keepalive_are_dispatched(monkeypatch):
+    received = []
+    monkeypatch.setitem(listener._handlers, "genre", [received.append])
+    monkeypatch.setattr(listener, "_flush_handlers", [])
+
+    def idle_select(*args):
+        # Two idle keepalive rounds and no socket activity, then the listener is asked to stop
+        idle_select.rounds += 1
+        if idle_select.rounds == 2:
+            listener._stop.set()
+        return [], [], []
+    idle_select.rounds = 0
+    monkeypatch.setattr(listener.select, "select", idle_select)
+
+    listener._stop.clear()
+    try:
+        listener._listen(FakeConnection())
+    finally:
+        listener._stop.clear()
+        listener._connected.clear()
+    assert received == [{"table": "genre", "op": "UPDATE", "id": 1}]
@@ -0,0 +1,29 @@
+import profiling
+
+def test_admin_profile(client, admin_headers):
+    response = client.get("/films/", headers={**admin_headers, "X-Profile": "1"})
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    listed = client.get("/admin/profiles", headers=admin_headers).json()
+    assert str(listed[0]["id"]) == profile_id and listed[0]["path"] == "/films/"
+
+    profile = client.get(f"/admin/profiles/{profile_id}", headers=admin_headers).json()
+    assert {"dependencies", "endpoint", "serialization", "total"} <= set(profile["phases_ms"])
+
+    collapsed = client.get(f"/admin/profiles/{profile_id}?format=collapsed", headers=admin_headers)
+    assert collapsed.headers["content-type"].startswith("text/plain")
+
+    assert client.get("/admin/profiles/0", headers=admin_headers).status_code == 404
+
+def test_profile_header_ignored_for_users(client, user_headers, monkeypatch):
+    started = []
+    monkeypatch.setattr(profiling, "_start", started.append)
+    kept = len(profiling._profiles)
+    for headers in (user_headers, {"Authorization": "Bearer junk"}):
+        response = client.get("/films/", headers={**headers, "X-Profile": "1"})
+        assert response.status_code == 200
+        assert "X-Profile-Id" not in response.headers
+    # Refused before anything was sampled or timed
+    assert started == [] and len(profiling._profiles) == kept
+    assert client.get("/admin/profiles", headers=user_headers).status_code == 403
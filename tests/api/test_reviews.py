@@ -0,0 +1,70 @@
+import pytest
+import schemas
+from .conftest import make_user, auth_headers
+
+@pytest.fixture
+def film(repo):
+    return repo.create_film(schemas.FilmCreate(filmname="Сталкер", year=1979, genres=["Драма"]))
+
+def post_review(client, film_id, headers, grade, text="Хорошо"):
+    response = client.post(f"/films/{film_id}/reviews", json={"reviewtext": text, "tengrade": grade, "binarygrade": True},
+                           headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+def test_review_updates_rating(client, repo, film, user_headers):
+    review = post_review(client, film["id"], user_headers, 8)
+    assert review["film"]["average_rating"] == 8
+    assert review["user"]["email"] == "viewer@example.com"
+
+    make_user(repo, "other@example.com")
+    post_review(client, film["id"], auth_headers("other@example.com"), 5)
+    assert client.get(f"/films/{film['id']}").json()["average_rating"] == 6.5
+
+def test_second_review_replaces_first(client, film, user_headers):
+    first = post_review(client, film["id"], user_headers, 8)
+    second = post_review(client, film["id"], user_headers, 3, text="Передумал")
+    assert second["id"] == first["id"]
+    reviews = client.get(f"/films/{film['id']}/reviews").json()
+    assert [(review["reviewtext"], review["tengrade"]) for review in reviews] == [("Передумал", 3)]
+
+def test_review_fields(client, film, user_headers):
+    post_review(client, film["id"], user_headers, 8)
+    response = client.get(f"/films/{film['id']}/reviews?fields=reviewtext,user.name")
+    assert response.json() == [{"id": 1, "reviewtext": "Хорошо", "user": {"id": 1, "name": "viewer"}}]
+
+    response = client.get("/reviews/?fields=tengrade,film.filmname")
+    assert response.json() == [{"id": 1, "tengrade": 8, "film": {"id": film["id"], "filmname": "Сталкер"}}]
+
+def test_only_author_or_admin_can_change_review(client, repo, film, user_headers, admin_headers):
+    review = post_review(client, film["id"], user_headers, 8)
+    make_user(repo, "other@example.com")
+    other_headers = auth_headers("other@example.com")
+    body = {"reviewtext": "Плохо", "tengrade": 1, "binarygrade": False}
+
+    assert client.post(f"/reviews/{review['id']}/update", json=body, headers=other_headers).status_code == 403
+    response = client.post(f"/reviews/{review['id']}/update", json=body, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()["film"]["average_rating"] == 1
+
+    assert client.delete(f"/reviews/{review['id']}", headers=other_headers).status_code == 403
+    response = client.delete(f"/reviews/{review['id']}", headers=user_headers)
+    assert response.status_code == 200
+    assert response.json()["film"]["average_rating"] == 0
+    assert client.get(f"/films/{film['id']}/reviews").json() == []
+
+def test_user_review_history(client, repo, user_headers):
+    films = [repo.create_film(schemas.FilmCreate(filmname=f"Фильм {i}", year=2000 + i)) for i in range(5)]
+    for film in films:
+        post_review(client, film["id"], user_headers, 7)
+
+    response = client.get("/users/me/reviews?limit=2", headers=user_headers)
+    assert [review["film"]["filmname"] for review in response.json()] == ["Фильм 4", "Фильм 3"]
+    assert response.json()[0]["film"]["average_rating"] == 7
+
+    pages = [response.json()]
+    while "X-Next-Cursor" in response.headers:
+        response = client.get(f"/users/1/reviews?limit=2&before={response.headers['X-Next-Cursor']}")
+        pages.append(response.json())
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert client.get("/users/2/reviews").json() == []
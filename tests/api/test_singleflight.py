@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+import threading
+import time
+import pytest
+import singleflight
+
+def run_concurrently(key, fn, followers=3):
+    """Start a leader running fn, then followers once it is inside fn, and collect results or errors."""
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(singleflight.do(key, fn, timeout=2))
+        except Exception as e:
+            outcomes.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    while key not in singleflight._calls:
+        time.sleep(0.001)
+    threads = [threading.Thread(target=call) for _ in range(followers)]
+    for thread in threads:
+        thread.start()
+    # Followers are parked on the leader's event before it is allowed to finish
+    time.sleep(0.05)
+    return leader, threads, outcomes
+
+def test_concurrent_calls_share_one_execution():
+    release = threading.Event()
+    executions = []
+
+    def query():
+        executions.append(1)
+        release.wait(2)
+        return ["film"]
+
+    leader, threads, outcomes = run_concurrently(("films", 1), query)
+    release.set()
+    for thread in [leader, *threads]:
+        thread.join()
+    assert len(executions) == 1
+    assert len(outcomes) == 4 and all(outcome is outcomes[0] for outcome in outcomes)
+    assert ("films", 1) not in singleflight._calls
+
+def test_errors_reach_every_caller():
+    release = threading.Event()
+
+    def query():
+        release.wait(2)
+        raise ValueError("bad query")
+
+    leader, threads, outcomes = run_concurrently(("films", 2), query)
+    release.set()
+    for thread in [leader, *threads]:
+        thread.join()
+    assert len(outcomes) == 4 and all(isinstance(outcome, ValueError) for outcome in outcomes)
+
+def test_abandoned_leader_is_retried(monkeypatch):
+    release = threading.Event()
+    executions = []
+    leader_ident = []
+
+    def query():
+        executions.append(threading.get_ident())
+        if len(executions) == 1:
+            leader_ident.append(threading.get_ident())
+            release.wait(2)
+            raise RuntimeError("canceling statement due to user request")
+        time.sleep(0.1)  # long enough for the other follower to join the retry
+        return ["film"]
+
+    # Only the first leader's client went away
+    monkeypatch.setattr(singleflight, "client_disconnected", lambda: threading.get_ident() in leader_ident)
+    leader, threads, outcomes = run_concurrently(("films", 3), query, followers=2)
+    release.set()
+    for thread in [leader, *threads]:
+        thread.join()
+    # One follower ran the query again and shared it with the other
+    assert len(executions) == 2
+    assert sorted(map(repr, outcomes)) == sorted(map(repr, [RuntimeError("canceling statement due to user request"), ["film"], ["film"]]))
+
+def test_waiting_times_out():
+    release = threading.Event()
+    threading.Thread(target=singleflight.do, args=(("films", 4), lambda: release.wait(2))).start()
+    while ("films", 4) not in singleflight._calls:
+        time.sleep(0.001)
+    with pytest.raises(singleflight.Timeout):
+        singleflight.do(("films", 4), lambda: None, timeout=0.01)
+    release.set()
+
+def test_forget_all_starts_a_new_execution():
+    release = threading.Event()
+    threading.Thread(target=singleflight.do, args=(("films", 5), lambda: release.wait(2))).start()
+    while ("films", 5) not in singleflight._calls:
+        time.sleep(0.001)
+    singleflight.forget_all()
+    assert singleflight.do(("films", 5), lambda: "fresh") == "fresh"
+    release.set()
+
+def test_calls_on_different_servers_are_not_shared():
+    release = threading.Event()
+    servers = []
+
+    @singleflight.coalesce
+    def get_snapshot_age(conn):
+        servers.append(conn.dsn)
+        release.wait(2)
+        return conn.dsn
+
+    outcomes = []
+    threads = [threading.Thread(target=lambda dsn=dsn: outcomes.append(get_snapshot_age(SimpleNamespace(dsn=dsn))))
+               for dsn in ("host=primary", "host=replica")]
+    for thread in threads:
+        thread.start()
+    # Both run the query, a joined follower would wait for the leader instead
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert sorted(servers) == sorted(outcomes) == ["host=primary", "host=replica"]